@@ -0,0 +1,258 @@
+"""Headless benchmark of discrop’s hot paths, using the in-memory OBS and Discord stand-ins in ``stubs``.
+
+    python bench/bench.py --scenes 40 --items 10 --participants 12 --ticks 2000 --events-per-tick 0.2
+
+Reports per-tick latency percentiles and OBS API calls per tick, both with a steady call and while events come in,
+as well as how many voice state and member update events the client handles per second, and what switching scenes costs.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, 'stubs'))
+sys.path.insert(1, os.path.dirname(HERE))
+
+import discord
+import obspython as obs
+
+NAMES = ('alice', 'Bob', 'carol', 'dave', 'dave d', 'Eve', 'frank', 'Grace', 'heidi', 'Ivan', 'judy', 'Mallory', 'Oscar', 'peggy', 'Trent', 'Victor', 'walter', 'Yan', 'zed')
+
+GUILD = 100
+CHANNEL = 200
+OTHER_CHANNEL = 201
+SOURCE = 'Discord call'
+
+
+def run(coro):
+    """Run an event handler to completion. They never actually wait on anything here."""
+    try:
+        coro.send(None)
+    except StopIteration:
+        pass
+    else:
+        raise RuntimeError('Event handler awaited something')
+
+
+def percentiles(samples, *ps):
+    samples = sorted(samples)
+    if not samples:
+        return [0] * len(ps)
+    return [samples[min(len(samples) - 1, int(len(samples) * p / 100))] for p in ps]
+
+
+class Bench:
+
+    def __init__(self, args):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        obs.reset()
+        asyncio.set_event_loop(asyncio.new_event_loop())
+        import discrop
+        import discrop_client
+        self.discrop = discrop
+
+        # OBS side: a window per call, and every scene with the same Discord items, each on top of an audio-only overlay.
+        sources = [obs.create_source(SOURCE + (f' {c + 1}' if c else ''), args.width, args.height) for c in range(args.calls)]
+        overlay = obs.create_source('Audio-only overlay', 320, 180)
+        filler = obs.create_source('Background', 1920, 1080)
+        self.scenes = []
+        for s in range(args.scenes):
+            scene = obs.create_scene(f'Scene {s}')
+            self.scenes.append(scene)
+            scene.add(filler)
+            for source in sources:
+                for i in range(args.items):
+                    scene.add(overlay)
+                    item = scene.add(source)
+                    item.scale = (0.5, 0.5)
+        obs.frontend['program'] = self.scenes[0].source
+
+        # Discord side: a guild with a voice channel per call holding the participants, and some more members outside of them.
+        self.guild = discord.Guild(GUILD, 'Guild')
+        self.calls = [discord.VoiceChannel(CHANNEL + c * 10, f'Call {c + 1}', self.guild) for c in range(args.calls)]
+        self.other = discord.VoiceChannel(OTHER_CHANNEL, 'Elsewhere', self.guild, 1)
+        self.members = []
+        for k in range(args.participants * args.calls + args.members):
+            user = discord.User(1000 + k, self.rng.choice(NAMES) + str(k))
+            member = discord.Member(user, self.guild, nick=self.rng.choice((None, None, 'nick' + str(k))))
+            if k < args.participants * args.calls:
+                member.voice = discord.VoiceState(self.calls[k % args.calls], self.rng.random() < args.video)
+            self.guild._add_member(member)
+            self.members.append(member)
+
+        self.settings = obs.obs_data_create()
+        obs.obs_data_set_int(self.settings, 'calls', args.calls)
+        obs.obs_data_set_bool(self.settings, 'instrumentation', args.instrumentation)
+        obs.obs_data_set_bool(self.settings, 'active_scenes_only', args.active_only)
+        for c, channel in enumerate(self.calls):
+            prefix = f'call{c + 1}_' if c else ''
+            obs.obs_data_set_string(self.settings, prefix + 'voice_channel', str(channel.id))
+            obs.obs_data_set_string(self.settings, prefix + 'discord_source', sources[c].name)
+            obs.obs_data_set_bool(self.settings, prefix + 'show_nonvideo_participants', args.nonvideo)
+            obs.obs_data_set_bool(self.settings, prefix + 'item_right_below', True)
+            obs.obs_data_set_string(self.settings, prefix + 'myself', str(self.members[c].id))
+            for i in range(discrop.SLOTS):
+                obs.obs_data_set_string(self.settings, prefix + f'participant{i}', str(self.members[(c + i * args.calls) % len(self.members)].id))
+
+        # What script_load does, minus logging into Discord.
+        discrop.read_settings(self.settings)
+        obs.obs_frontend_add_event_callback(discrop.frontend_event)
+        self.client = discrop.client = discrop_client.Client()
+        self.client.add_guild(self.guild)
+        self.client.start_ready()
+        discrop.script_update(self.settings)
+
+    def event(self):
+        """Feed the client a random voice state or member update event, like a busy call would."""
+        member = self.rng.choice(self.members)
+        if self.rng.random() < self.args.renames:
+            before = member._copy()
+            member.nick = 'renamed' + str(self.rng.randrange(1000))
+            run(self.client.on_member_update(before, member))
+            return 'member_update'
+        before = member.voice or discord.VoiceState()
+        r = self.rng.random()
+        if before.channel in self.calls and r < 0.6:
+            after = discord.VoiceState(before.channel, not before.self_video) # Camera toggle.
+        elif before.channel in self.calls:
+            after = discord.VoiceState(self.rng.choice([None, self.other] + self.calls)) # Leaves, maybe for another call.
+        else:
+            after = discord.VoiceState(self.rng.choice(self.calls), self.rng.random() < self.args.video) # Joins.
+        member.voice = after if after.channel else None
+        run(self.client.on_voice_state_update(member, before, after))
+        return 'voice_state_update'
+
+    def ticks(self, count, events_per_tick):
+        latencies = []
+        calls = 0
+        pending = 0.0
+        for _ in range(count):
+            pending += events_per_tick
+            while pending >= 1:
+                self.event()
+                pending -= 1
+            before = sum(obs.calls.values())
+            start = time.perf_counter()
+            self.discrop.script_tick(1 / 60)
+            latencies.append(time.perf_counter() - start)
+            calls += sum(obs.calls.values()) - before
+            obs.render()
+        return latencies, calls / count
+
+    def events(self, count):
+        """Handle events and apply them to the rosters, the latter as often as a tick would at the churn phase’s rate."""
+        handled = {}
+        per_drain = max(1, round(self.args.events_per_tick))
+        start = time.perf_counter()
+        for k in range(count):
+            kind = self.event()
+            handled[kind] = handled.get(kind, 0) + 1
+            if k % per_drain == per_drain - 1:
+                self.client.drain()
+        self.client.drain()
+        return handled, count / (time.perf_counter() - start)
+
+    def storm(self, count):
+        """Have people join the first call all within the same frame, like when a meeting starts, and time the tick that follows."""
+        outside = [x for x in self.members if not x.voice][:count]
+        for member in outside:
+            before = discord.VoiceState()
+            member.voice = discord.VoiceState(self.calls[0], self.rng.random() < self.args.video)
+            run(self.client.on_voice_state_update(member, before, member.voice))
+        roster = self.client.rosters[self.calls[0].id]
+        latencies, calls = self.ticks(1, 0)
+        # Generations are shared by every call, so the roster itself tells whether this one was published.
+        return {'joins': len(outside), 'ms': latencies[0] * 1000, 'obs_calls': calls, 'publishes': int(self.client.rosters[self.calls[0].id] is not roster)}
+
+    def switch(self):
+        """Switch to the next scene, and time the tick that follows, which catches it up when only scenes on screen are kept up to date."""
+        current = self.scenes.index(obs.frontend['program'].scene)
+        obs.frontend['program'] = self.scenes[(current + 1) % len(self.scenes)].source
+        obs.frontend_event(obs.OBS_FRONTEND_EVENT_SCENE_CHANGED)
+        latencies, calls = self.ticks(1, 0)
+        obs.frontend_event(obs.OBS_FRONTEND_EVENT_TRANSITION_STOPPED)
+        return {'ms': latencies[0] * 1000, 'obs_calls': calls}
+
+    def report(self):
+        args = self.args
+        results = {}
+
+        # Warm-up: the first tick builds the scene index and applies everything.
+        obs.calls.clear()
+        latencies, calls = self.ticks(1, 0)
+        results['first_tick'] = {'ms': latencies[0] * 1000, 'obs_calls': calls}
+
+        for name, rate in (('steady', 0), ('churn', args.events_per_tick)):
+            obs.calls.clear()
+            latencies, calls = self.ticks(args.ticks, rate)
+            p50, p90, p99 = percentiles(latencies, 50, 90, 99)
+            results[name] = {
+                'events_per_tick': rate,
+                'p50_us': p50 * 1e6,
+                'p90_us': p90 * 1e6,
+                'p99_us': p99 * 1e6,
+                'max_us': max(latencies) * 1e6,
+                'obs_calls_per_tick': calls,
+                'top_obs_calls': dict(obs.calls.most_common(8)),
+            }
+
+        results['storm'] = self.storm(args.storm)
+        results['switch'] = self.switch()
+
+        handled, throughput = self.events(args.events)
+        results['events'] = {'handled': handled, 'per_second': throughput}
+        if args.instrumentation:
+            results['instrumentation'] = self.discrop.stats.summary()
+        return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--scenes', type=int, default=40, help='scenes in the collection')
+    parser.add_argument('--calls', type=int, default=1, help='calls mapped at once, each with its own source and channel')
+    parser.add_argument('--items', type=int, default=10, help='Discord items per scene and call')
+    parser.add_argument('--participants', type=int, default=10, help='people in each call to begin with')
+    parser.add_argument('--members', type=int, default=200, help='guild members outside of the call')
+    parser.add_argument('--video', type=float, default=0.7, help='chance of a participant having video')
+    parser.add_argument('--nonvideo', action='store_true', help='Show Non-Video Participants on')
+    parser.add_argument('--width', type=int, default=1920, help='call window width')
+    parser.add_argument('--height', type=int, default=1080, help='call window height')
+    parser.add_argument('--ticks', type=int, default=1000, help='ticks per phase')
+    parser.add_argument('--events-per-tick', type=float, default=0.25, help='Discord events per tick in the churn phase')
+    parser.add_argument('--renames', type=float, default=0.2, help='share of events that are nickname changes')
+    parser.add_argument('--storm', type=int, default=10, help='people joining within a single frame in the storm phase')
+    parser.add_argument('--events', type=int, default=20000, help='events for the throughput phase')
+    parser.add_argument('--active-only', action='store_true', help='turn on Only update scenes on screen, with the first scene on program')
+    parser.add_argument('--instrumentation', action='store_true', help='turn on the script’s own instrumentation, and print its summary')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args(argv)
+
+    results = Bench(args).report()
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{args.scenes} scenes × {args.calls} calls × {args.items} Discord items, {args.participants} participants per call")
+    print(f"first tick: {results['first_tick']['ms']:.2f} ms, {results['first_tick']['obs_calls']:.0f} OBS calls")
+    for name in ('steady', 'churn'):
+        r = results[name]
+        print(f"{name} ({r['events_per_tick']} events/tick): p50 {r['p50_us']:.1f} µs, p90 {r['p90_us']:.1f} µs, p99 {r['p99_us']:.1f} µs, max {r['max_us']:.1f} µs, {r['obs_calls_per_tick']:.1f} OBS calls/tick")
+        for call, count in r['top_obs_calls'].items():
+            print(f'    {call}: {count}')
+    r = results['storm']
+    print(f"storm ({r['joins']} joins in a frame): {r['ms']:.2f} ms, {r['obs_calls']:.0f} OBS calls, roster published {r['publishes']}×")
+    r = results['switch']
+    print(f"scene switch: {r['ms']:.2f} ms, {r['obs_calls']:.0f} OBS calls")
+    print(f"events: {results['events']['per_second']:.0f}/s {results['events']['handled']}")
+    if args.instrumentation:
+        print('instrumentation:')
+        print(results['instrumentation'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,298 @@
+"""Replay a Discord event trace recorded by discrop (see *Record Discord events* in its settings), headless.
+
+    python bench/replay.py discrop-trace-20240101-200000.jsonl
+    python bench/replay.py trace.jsonl --script old/discrop.py --json > old.json
+
+Feeds the trace through the client’s event handlers and ``script_tick``, frame by frame, against the in-memory OBS and
+Discord stand-ins in ``stubs``, either as fast as possible or in real time. Reports how long each kind of event and
+each tick took, and the final crop and visibility of every item, so that layouts can be diffed across versions.
+"""
+import argparse
+import asyncio
+import hashlib
+import importlib.util
+import json
+import os
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, 'stubs'))
+
+import discord
+import obspython as obs
+
+from bench import percentiles
+
+FPS = 60
+
+
+def load_script(path):
+    # Along with the modules next to it, rather than those of another version.
+    sys.path.insert(1, os.path.dirname(os.path.abspath(path)))
+    for name in ('discrop_client', 'discrop_shared'):
+        sys.modules.pop(name, None)
+    spec = importlib.util.spec_from_file_location('discrop', path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules['discrop'] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+class Replay:
+
+    def __init__(self, args, records):
+        self.args = args
+        self.records = records
+        obs.reset()
+        asyncio.set_event_loop(asyncio.new_event_loop())
+        self.discrop = discrop = load_script(args.script)
+
+        # The settings in effect when recording started, minus the recording itself.
+        first = next((x['settings'] for x in records if x['e'] == 'settings'), {})
+        self.settings = self.parse_settings(first)
+
+        # OBS side: a window per call, and every scene with a full set of items for each, each on top of an audio-only overlay.
+        sizes = {}
+        for record in records:
+            if record['e'] == 'source':
+                sizes.setdefault(record['call'], (record['width'], record['height']))
+        overlay = obs.create_source('Audio-only overlay', 320, 180)
+        self.sources = {}
+        for binding in discrop.bindings[:discrop.calls_setting(self.settings)]:
+            name = obs.obs_data_get_string(self.settings, binding.key('discord_source'))
+            if name and name not in obs.sources:
+                obs.create_source(name, *sizes.get(binding.number, (args.width, args.height)))
+            self.sources[binding.number] = obs.sources.get(name)
+        self.items = []
+        for s in range(args.scenes):
+            scene = obs.create_scene(f'Scene {s}')
+            for number, source in self.sources.items():
+                for i in range(discrop.SLOTS):
+                    below = scene.add(overlay)
+                    item = scene.add(source)
+                    item.scale = (0.5, 0.5)
+                    self.items.append((scene.source.name, number, i, item, below))
+
+        # Discord side: filled in as the trace goes.
+        self.guilds = {}
+        self.channels = {}
+        discrop.read_settings(self.settings)
+        obs.obs_frontend_add_event_callback(discrop.frontend_event)
+        Client = getattr(discrop, 'Client', None) or importlib.import_module('discrop_client').Client # Before it had a module of its own.
+        self.client = discrop.client = Client(obs.obs_data_get_bool(self.settings, 'lean_gateway'))
+        discrop.script_update(self.settings)
+
+        self.handlers = {} # Kind -> seconds each event took.
+        self.ticks = []
+        self.busy_ticks = []
+
+    def parse_settings(self, settings):
+        settings = obs.obs_data_create_from_json(json.dumps(settings))
+        obs.obs_data_set_bool(settings, 'record_trace', False)
+        obs.obs_data_set_bool(settings, 'instrumentation', False)
+        return settings
+
+    # Rebuilding Discord objects out of the trace.
+    def guild(self, data):
+        guild_id, name, channels = data
+        guild = self.guilds.get(guild_id)
+        if not guild:
+            guild = self.guilds[guild_id] = discord.Guild(guild_id, name)
+            self.client.add_guild(guild)
+        guild.name = name
+        for channel in channels:
+            self.channel(guild, channel)
+        return guild
+
+    def channel(self, guild, data):
+        channel_id, name, position = data
+        channel = self.channels.get(channel_id)
+        if not channel:
+            channel = self.channels[channel_id] = discord.VoiceChannel(channel_id, name, guild, position)
+        channel.name = name
+        channel.position = position
+        return channel
+
+    def member(self, guild_id, data):
+        uid, name, discriminator, nick = data
+        guild = self.guilds[guild_id]
+        member = guild.get_member(uid)
+        if not member:
+            member = discord.Member(discord.User(uid, name, discriminator), guild)
+            guild._add_member(member)
+        member._user.name = name
+        member._user.discriminator = discriminator
+        member.nick = nick
+        return member
+
+    def voice(self, data):
+        channel_id, video = data
+        return discord.VoiceState(self.channels.get(channel_id), video)
+
+    def dispatch(self, event, *args):
+        start = time.perf_counter()
+        self.client.dispatch(event, *args)
+        self.handlers.setdefault(event, []).append(time.perf_counter() - start)
+
+    def play(self, record):
+        e = record['e']
+        if e == 'settings':
+            self.settings = self.parse_settings(record['settings'])
+            self.discrop.script_update(self.settings)
+        elif e == 'source':
+            source = self.sources.get(record['call'])
+            if source:
+                source.width = record['width']
+                source.height = record['height']
+        elif e == 'ready':
+            for guild in record['guilds']:
+                self.guild(guild)
+            if not self.client.is_ready():
+                self.client.start_ready()
+        elif e == 'call':
+            # Who was in the call when it started being watched, or when its guild got chunked.
+            channel = self.channels[record['channel']]
+            uids = set()
+            for member in record['members']:
+                video = member.pop()
+                member = self.member(channel.guild.id, member)
+                member.voice = discord.VoiceState(channel, video)
+                uids.add(member.id)
+            for member in channel.members:
+                if member.id not in uids:
+                    member.voice = None
+            if record['channel'] in self.client._watched:
+                self.client._snapshot(channel)
+        elif e == 'voice_state_update':
+            member = self.member(record['guild'], record['member'])
+            before = self.voice(record['before'])
+            after = self.voice(record['after'])
+            member.voice = after if after.channel else None
+            self.dispatch(e, member, before, after)
+        elif e == 'member_update':
+            before = self.member(record['guild'], record['before'])._copy()
+            after = self.member(record['guild'], record['after'])
+            voice = record['voice'] and self.voice(record['voice'])
+            before.voice = after.voice = voice if voice and voice.channel else None
+            self.dispatch(e, before, after)
+        elif e == 'member_join':
+            self.dispatch(e, self.member(record['guild'], record['member']))
+        elif e == 'member_remove':
+            guild = self.guilds[record['guild']]
+            member = guild.get_member(record['member'])
+            if member:
+                guild._remove_member(member)
+                self.dispatch(e, member)
+        elif e == 'guild_join':
+            self.dispatch(e, self.guild(record['guild']))
+        elif e == 'guild_remove':
+            guild = self.guilds.pop(record['guild'], None)
+            if guild:
+                self.client._guilds.pop(guild.id, None)
+                self.dispatch(e, guild)
+        elif e in ('guild_channel_create', 'guild_channel_update'):
+            channel = self.channel(self.guilds[record['guild']], record['channel'])
+            self.dispatch(e, *((channel,) if e == 'guild_channel_create' else (channel, channel)))
+        elif e == 'guild_channel_delete':
+            channel = self.channels.pop(record['channel'], None)
+            if channel:
+                channel.guild.channels.remove(channel)
+                self.dispatch(e, channel)
+
+    def tick(self):
+        calls = sum(obs.calls.values())
+        start = time.perf_counter()
+        self.discrop.script_tick(1 / FPS)
+        elapsed = time.perf_counter() - start
+        self.ticks.append(elapsed)
+        if sum(obs.calls.values()) - calls > 2 * len(self.sources): # More than checking the call windows’ size.
+            self.busy_ticks.append(elapsed)
+        obs.render()
+
+    def run(self):
+        """Play every record within the frame it fell in, ticking at the end of each frame."""
+        frame = 1 / FPS
+        speed = self.args.speed
+        start = time.perf_counter()
+        pending = iter(self.records)
+        record = next(pending, None)
+        end = self.records[-1]['t'] if self.records else 0
+        t = 0.0
+        while record or t <= end:
+            t += frame
+            while record and record['t'] < t:
+                self.play(record)
+                record = next(pending, None)
+            if self.args.realtime:
+                delay = start + t / speed - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            elif not self.client.events and record and record['t'] >= t + frame:
+                t = (record['t'] // frame) * frame # Nothing would happen until the next record anyway.
+            self.tick()
+        self.tick()
+
+    def state(self):
+        """Crop, scale, bounds and visibility of every Discord item, plus the visibility of the one below it."""
+        return [{
+            'scene': scene,
+            'call': number + 1,
+            'item': i + 1,
+            'visible': item.visible,
+            'crop': item.crop,
+            'scale': item.scale,
+            'bounds': item.bounds,
+            'below_visible': below.visible,
+        } for scene, number, i, item, below in self.items]
+
+    def report(self):
+        start = time.perf_counter()
+        self.run()
+        wall = time.perf_counter() - start
+        state = self.state()
+        results = {'records': len(self.records), 'wall_s': wall, 'events': {}}
+        for kind, samples in sorted(self.handlers.items()):
+            p50, p99 = percentiles(samples, 50, 99)
+            results['events'][kind] = {'count': len(samples), 'p50_us': p50 * 1e6, 'p99_us': p99 * 1e6, 'max_us': max(samples) * 1e6}
+        for name, samples in (('ticks', self.ticks), ('busy_ticks', self.busy_ticks)):
+            p50, p99 = percentiles(samples, 50, 99)
+            results[name] = {'count': len(samples), 'p50_us': p50 * 1e6, 'p99_us': p99 * 1e6, 'max_us': max(samples, default=0) * 1e6}
+        results['obs_calls'] = dict(obs.calls.most_common())
+        results['digest'] = hashlib.sha1(json.dumps(state).encode()).hexdigest()
+        results['state'] = state
+        return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('trace', help='trace file recorded by the script')
+    parser.add_argument('--script', default=os.path.join(os.path.dirname(HERE), 'discrop.py'), help='version of discrop.py to replay it against')
+    parser.add_argument('--scenes', type=int, default=10, help='scenes in the collection, each with a full set of Discord items per call')
+    parser.add_argument('--width', type=int, default=1920, help='call window width, unless the trace says')
+    parser.add_argument('--height', type=int, default=1080, help='call window height, unless the trace says')
+    parser.add_argument('--realtime', action='store_true', help='play it back at the pace it was recorded, rather than as fast as possible')
+    parser.add_argument('--speed', type=float, default=1, help='how much faster than real time to play it back with --realtime')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON, final item state included')
+    args = parser.parse_args(argv)
+
+    with open(args.trace, encoding='utf-8') as f:
+        records = [json.loads(x) for x in f if x.strip()]
+    results = Replay(args, records).report()
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{results['records']} records replayed in {results['wall_s']:.2f} s")
+    for kind, r in results['events'].items():
+        print(f"{kind}: {r['count']}×, p50 {r['p50_us']:.1f} µs, p99 {r['p99_us']:.1f} µs, max {r['max_us']:.1f} µs")
+    for name in ('ticks', 'busy_ticks'):
+        r = results[name]
+        print(f"{name}: {r['count']}×, p50 {r['p50_us']:.1f} µs, p99 {r['p99_us']:.1f} µs, max {r['max_us']:.1f} µs")
+    print(f"final state digest: {results['digest']}")
+    for item in results['state']:
+        if item['scene'] == 'Scene 0':
+            print(f"    call {item['call']} item {item['item']}: {'shown' if item['visible'] else 'hidden'}, crop {item['crop']}, item below {'shown' if item['below_visible'] else 'hidden'}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,221 @@
+"""In-memory stand-in for the parts of discord.py 1.x that discrop uses.
+
+There is no gateway: guilds, channels and members are built directly, and
+benchmarks call the client's event handlers themselves.
+"""
+import asyncio
+import types
+
+
+class Intents:
+
+    def __init__(self, **kwargs):
+        self.guilds = False
+        self.members = False
+        self.voice_states = False
+        for key, value in kwargs.items():
+            setattr(self, key, value)
+
+
+class MemberCacheFlags:
+
+    def __init__(self, **kwargs):
+        self.online = False
+        self.voice = True
+        self.joined = True
+        for key, value in kwargs.items():
+            setattr(self, key, value)
+
+    @classmethod
+    def none(cls):
+        return cls(voice=False, joined=False)
+
+    @classmethod
+    def from_intents(cls, intents):
+        return cls(voice=intents.voice_states, joined=intents.members)
+
+
+class Permissions:
+
+    def __init__(self, **kwargs):
+        self.value = 0
+
+
+class ClientException(Exception):
+    pass
+
+
+class Object:
+
+    def __init__(self, id):
+        self.id = id
+
+
+class User:
+
+    def __init__(self, id, name, discriminator='0001'):
+        self.id = id
+        self.name = name
+        self.discriminator = discriminator
+
+
+class Guild:
+
+    def __init__(self, id, name):
+        self.id = id
+        self.name = name
+        self.channels = []
+        self._members = {}
+        self.chunked = True
+
+    @property
+    def members(self):
+        return list(self._members.values())
+
+    def get_member(self, id):
+        return self._members.get(id)
+
+    def _add_member(self, member):
+        self._members[member.id] = member
+
+    def _remove_member(self, member):
+        self._members.pop(member.id, None)
+
+    async def chunk(self, *, cache=True):
+        if cache:
+            self.chunked = True
+        return self.members
+
+    async def query_members(self, query=None, *, limit=5, user_ids=None, presences=False, cache=True):
+        query = (query or '').lower()
+        found = [x for x in self._members.values() if x.name.lower().startswith(query) or (x.nick or '').lower().startswith(query)]
+        return found[:limit]
+
+    def __eq__(self, other):
+        return isinstance(other, Guild) and other.id == self.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+
+class VoiceChannel:
+
+    def __init__(self, id, name, guild, position=0):
+        self.id = id
+        self.name = name
+        self.guild = guild
+        self.position = position
+        guild.channels.append(self)
+
+    @property
+    def members(self):
+        return [x for x in self.guild._members.values() if x.voice and x.voice.channel == self]
+
+    def __eq__(self, other):
+        return isinstance(other, VoiceChannel) and other.id == self.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+
+class VoiceState:
+
+    def __init__(self, channel=None, self_video=False):
+        self.channel = channel
+        self.self_video = self_video
+
+
+class Member:
+
+    def __init__(self, user, guild, nick=None, voice=None):
+        self._user = user
+        self.guild = guild
+        self.nick = nick
+        self.voice = voice
+
+    @property
+    def id(self):
+        return self._user.id
+
+    @property
+    def name(self):
+        return self._user.name
+
+    @property
+    def discriminator(self):
+        return self._user.discriminator
+
+    @property
+    def display_name(self):
+        return self.nick or self.name
+
+    def _copy(self):
+        copy = Member(self._user, self.guild, self.nick, self.voice)
+        return copy
+
+    def __eq__(self, other):
+        return getattr(other, 'id', None) == self.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+
+class Client:
+
+    def __init__(self, *, loop=None, **options):
+        self.loop = asyncio.get_event_loop() if loop is None else loop
+        self.options = options
+        self.intents = options.get('intents')
+        self.user = User(1, 'discrop')
+        self._guilds = {}
+        self._ready = False
+        self._closed = False
+
+    @property
+    def guilds(self):
+        return list(self._guilds.values())
+
+    def add_guild(self, guild):
+        self._guilds[guild.id] = guild
+
+    def get_guild(self, id):
+        return self._guilds.get(id)
+
+    def get_channel(self, id):
+        for guild in self._guilds.values():
+            for channel in guild.channels:
+                if channel.id == id:
+                    return channel
+
+    def is_ready(self):
+        return self._ready
+
+    def is_closed(self):
+        return self._closed
+
+    def dispatch(self, event, *args, **kwargs):
+        method = getattr(self, 'on_' + event, None)
+        if method is not None:
+            coro = method(*args, **kwargs)
+            try:
+                coro.send(None)
+            except StopIteration:
+                pass
+
+    def start_ready(self):
+        """Mark the client as connected, as the gateway's READY would."""
+        self._ready = True
+        self.dispatch('ready')
+
+    def run(self, *args, **kwargs):
+        self.start_ready()
+
+    async def close(self):
+        self._closed = True
+
+
+def _oauth_url(client_id, permissions=None, guild=None, redirect_uri=None, scopes=None):
+    return f'https://discord.com/oauth2/authorize?client_id={client_id}&scope=bot'
+
+
+utils = types.SimpleNamespace(oauth_url=_oauth_url)
@@ -0,0 +1,679 @@
+"""In-memory stand-in for the parts of OBS's ``obspython`` module that discrop uses.
+
+Scenes, items and sources are plain Python objects, and every API function
+is counted in ``calls`` so benchmarks can report how much OBS work a tick did.
+"""
+import collections
+import functools
+import json
+import struct
+
+calls = collections.Counter()
+
+OBS_BOUNDS_NONE = 0
+OBS_BOUNDS_STRETCH = 1
+OBS_BOUNDS_SCALE_INNER = 2
+OBS_BOUNDS_SCALE_OUTER = 3
+
+OBS_COMBO_TYPE_LIST = 2
+OBS_COMBO_FORMAT_STRING = 3
+OBS_GROUP_NORMAL = 1
+OBS_TEXT_DEFAULT = 0
+OBS_TEXT_MULTILINE = 2
+
+OBS_TRANSITION_SOURCE_A = 0
+OBS_TRANSITION_SOURCE_B = 1
+
+LOG_ERROR = 100
+LOG_WARNING = 200
+LOG_INFO = 300
+LOG_DEBUG = 400
+
+OBS_FRONTEND_EVENT_SCENE_CHANGED = 8
+OBS_FRONTEND_EVENT_SCENE_LIST_CHANGED = 9
+OBS_FRONTEND_EVENT_TRANSITION_CHANGED = 10
+OBS_FRONTEND_EVENT_TRANSITION_STOPPED = 11
+OBS_FRONTEND_EVENT_TRANSITION_LIST_CHANGED = 12
+OBS_FRONTEND_EVENT_SCENE_COLLECTION_CHANGED = 13
+OBS_FRONTEND_EVENT_EXIT = 17
+OBS_FRONTEND_EVENT_STUDIO_MODE_ENABLED = 22
+OBS_FRONTEND_EVENT_STUDIO_MODE_DISABLED = 23
+OBS_FRONTEND_EVENT_PREVIEW_SCENE_CHANGED = 24
+OBS_FRONTEND_EVENT_SCENE_COLLECTION_CLEANUP = 25
+OBS_FRONTEND_EVENT_FINISHED_LOADING = 26
+
+
+def _api(f):
+    name = f.__name__
+
+    @functools.wraps(f)
+    def wrapper(*args, **kwargs):
+        calls[name] += 1
+        return f(*args, **kwargs)
+    return wrapper
+
+
+# Data.
+
+class _Data(dict):
+    pass
+
+
+@_api
+def obs_data_create():
+    return _Data()
+
+
+@_api
+def obs_data_create_from_json(text):
+    return _Data(json.loads(text))
+
+
+@_api
+def obs_data_get_json(data):
+    return json.dumps(data)
+
+
+@_api
+def obs_data_release(data):
+    pass
+
+
+@_api
+def obs_data_get_string(data, name):
+    return data.get(name, '')
+
+
+@_api
+def obs_data_get_bool(data, name):
+    return bool(data.get(name, False))
+
+
+@_api
+def obs_data_get_int(data, name):
+    return int(data.get(name, 0))
+
+
+@_api
+def obs_data_set_string(data, name, value):
+    data[name] = value
+
+
+@_api
+def obs_data_set_bool(data, name, value):
+    data[name] = bool(value)
+
+
+@_api
+def obs_data_set_int(data, name, value):
+    data[name] = int(value)
+
+
+@_api
+def obs_data_set_default_int(data, name, value):
+    data.setdefault(name, int(value))
+
+
+@_api
+def obs_data_erase(data, name):
+    data.pop(name, None)
+
+
+# Structs.
+
+class vec2:
+
+    def __init__(self):
+        self.x = 0.0
+        self.y = 0.0
+
+
+class obs_sceneitem_crop:
+
+    def __init__(self):
+        self.left = 0
+        self.top = 0
+        self.right = 0
+        self.bottom = 0
+
+
+@_api
+def vec2_set(v, x, y):
+    v.x = x
+    v.y = y
+
+
+# Signals.
+
+class _Calldata(dict):
+    pass
+
+
+class _SignalHandler:
+
+    def __init__(self):
+        self.callbacks = collections.defaultdict(list)
+
+    def emit(self, signal, **data):
+        for callback in list(self.callbacks[signal]):
+            callback(_Calldata(data))
+
+
+@_api
+def signal_handler_connect(handler, signal, callback):
+    handler.callbacks[signal].append(callback)
+
+
+@_api
+def signal_handler_disconnect(handler, signal, callback):
+    try:
+        handler.callbacks[signal].remove(callback)
+    except ValueError:
+        pass
+
+
+@_api
+def calldata_source(cd, name):
+    return cd.get(name)
+
+
+@_api
+def calldata_sceneitem(cd, name):
+    return cd.get(name)
+
+
+# Sources and scenes.
+
+sources = {}
+
+
+class _Source:
+
+    def __init__(self, name, id='window_capture', width=0, height=0):
+        self.name = name
+        self.id = id
+        self.width = width
+        self.height = height
+        self.scene = None
+        self.signals = _SignalHandler()
+        self.showing = False
+        sources[name] = self
+
+
+class _Scene:
+
+    def __init__(self, name):
+        self.source = _Source(name, 'scene')
+        self.source.scene = self
+        self.items = [] # Bottom to top, like obs_scene_enum_items.
+        self.next_id = 1
+
+    def add(self, source):
+        item = _SceneItem(self, source, self.next_id)
+        self.next_id += 1
+        self.items.append(item)
+        self.source.signals.emit('item_add', scene=self, item=item)
+        return item
+
+    def remove(self, item):
+        self.items.remove(item)
+        item.removed = True
+        self.source.signals.emit('item_remove', scene=self, item=item)
+
+    def reorder(self, items):
+        self.items = list(items)
+        self.source.signals.emit('reorder', scene=self)
+
+
+class _SceneItem:
+
+    def __init__(self, scene, source, id):
+        self.scene = scene
+        self.source = source
+        self.id = id
+        self.removed = False
+        self.visible = True
+        self.crop = (0, 0, 0, 0)
+        self.scale = (1.0, 1.0)
+        self.bounds = (0.0, 0.0)
+        self.bounds_type = OBS_BOUNDS_NONE
+        self.bounds_alignment = 0
+        self.deferred = 0
+        self.transform_updates = 0
+
+    def _transform(self):
+        # Like OBS 27 and later, only flag the item, and signal the change once the scene renders.
+        if not self.deferred and self not in pending:
+            self.transform_updates += 1
+            pending.append(self)
+
+
+scenes = []
+pending = [] # Items whose transform changed since the last render().
+
+
+def render():
+    """Emit the transform signals OBS would as it renders the next frame."""
+    items = list(pending)
+    pending.clear()
+    for item in items:
+        if not item.removed:
+            item.scene.source.signals.emit('item_transform', scene=item.scene, item=item)
+
+
+def _float(x):
+    # OBS stores vectors as 32-bit floats.
+    return struct.unpack('f', struct.pack('f', x))[0]
+
+
+def reset():
+    """Forget every source and scene, and zero the call counters."""
+    sources.clear()
+    scenes.clear()
+    pending.clear()
+    calls.clear()
+    frontend_callbacks.clear()
+    frontend['program'] = None
+    frontend['preview'] = None
+    frontend['transition'] = _Transition('Fade')
+
+
+def show(source, showing=True):
+    """Have source start or stop showing anywhere (e.g. in a projector), signalling it as OBS would."""
+    if showing != source.showing:
+        source.showing = showing
+        source.signals.emit('show' if showing else 'hide', source=source)
+
+
+def create_source(name, width=0, height=0, id='window_capture'):
+    return _Source(name, id, width, height)
+
+
+def create_scene(name):
+    scene = _Scene(name)
+    scenes.append(scene)
+    return scene
+
+
+@_api
+def obs_get_source_by_name(name):
+    return sources.get(name)
+
+
+@_api
+def obs_source_release(source):
+    pass
+
+
+@_api
+def obs_source_get_name(source):
+    return source.name if source else None
+
+
+@_api
+def obs_source_get_id(source):
+    return source.id
+
+
+@_api
+def obs_source_get_display_name(id):
+    return {'scene': 'Scene', 'window_capture': 'Window Capture'}.get(id, id)
+
+
+@_api
+def obs_source_get_width(source):
+    return source.width if source else 0
+
+
+@_api
+def obs_source_get_height(source):
+    return source.height if source else 0
+
+
+@_api
+def obs_source_get_signal_handler(source):
+    return source.signals
+
+
+@_api
+def obs_source_showing(source):
+    return source.showing
+
+
+@_api
+def obs_enum_sources():
+    return [x for x in sources.values() if x.id != 'scene']
+
+
+@_api
+def source_list_release(sources):
+    pass
+
+
+@_api
+def obs_scene_from_source(source):
+    return source.scene if source else None
+
+
+@_api
+def obs_scene_get_source(scene):
+    return scene.source
+
+
+@_api
+def obs_scene_enum_items(scene):
+    return list(scene.items)
+
+
+@_api
+def sceneitem_list_release(items):
+    pass
+
+
+@_api
+def obs_sceneitem_addref(item):
+    pass
+
+
+@_api
+def obs_sceneitem_release(item):
+    pass
+
+
+@_api
+def obs_sceneitem_get_id(item):
+    return item.id
+
+
+@_api
+def obs_sceneitem_get_scene(item):
+    return item.scene
+
+
+@_api
+def obs_sceneitem_get_source(item):
+    return item.source
+
+
+@_api
+def obs_sceneitem_visible(item):
+    return item.visible
+
+
+@_api
+def obs_sceneitem_set_visible(item, visible):
+    if visible != item.visible:
+        item.visible = visible
+        item.scene.source.signals.emit('item_visible', scene=item.scene, item=item, visible=visible)
+
+
+@_api
+def obs_sceneitem_get_crop(item, crop):
+    crop.left, crop.top, crop.right, crop.bottom = item.crop
+
+
+@_api
+def obs_sceneitem_set_crop(item, crop):
+    item.crop = (crop.left, crop.top, crop.right, crop.bottom)
+    item._transform()
+
+
+@_api
+def obs_sceneitem_get_scale(item, scale):
+    scale.x, scale.y = item.scale
+
+
+@_api
+def obs_sceneitem_set_scale(item, scale):
+    item.scale = (_float(scale.x), _float(scale.y))
+    item._transform()
+
+
+@_api
+def obs_sceneitem_get_bounds(item, bounds):
+    bounds.x, bounds.y = item.bounds
+
+
+@_api
+def obs_sceneitem_set_bounds(item, bounds):
+    item.bounds = (_float(bounds.x), _float(bounds.y))
+    item._transform()
+
+
+@_api
+def obs_sceneitem_get_bounds_type(item):
+    return item.bounds_type
+
+
+@_api
+def obs_sceneitem_set_bounds_type(item, bounds_type):
+    item.bounds_type = bounds_type
+    item._transform()
+
+
+@_api
+def obs_sceneitem_get_bounds_alignment(item):
+    return item.bounds_alignment
+
+
+@_api
+def obs_sceneitem_set_bounds_alignment(item, alignment):
+    item.bounds_alignment = alignment
+    item._transform()
+
+
+@_api
+def obs_sceneitem_defer_update_begin(item):
+    item.deferred += 1
+
+
+@_api
+def obs_sceneitem_defer_update_end(item):
+    item.deferred -= 1
+    if not item.deferred:
+        item._transform()
+
+
+# Transitions.
+
+class _Transition:
+
+    def __init__(self, name):
+        self.name = name
+        self.id = 'fade_transition'
+        self.signals = _SignalHandler()
+        self.showing = True
+        self.targets = [None, None]
+
+
+def start_transition(scene):
+    """Have the current transition start switching the program to ``scene``, as OBS would before the frontend's SCENE_CHANGED."""
+    transition = frontend['transition']
+    transition.targets = [frontend['program'], scene.source]
+    transition.signals.emit('transition_start', source=transition)
+
+
+@_api
+def obs_transition_get_source(transition, target):
+    return transition.targets[target]
+
+
+# Frontend.
+
+frontend = {'program': None, 'preview': None, 'transition': _Transition('Fade')}
+frontend_callbacks = []
+
+
+@_api
+def obs_frontend_get_scenes():
+    return [x.source for x in scenes]
+
+
+@_api
+def obs_frontend_get_current_scene():
+    return frontend['program']
+
+
+@_api
+def obs_frontend_get_current_preview_scene():
+    return frontend['preview']
+
+
+@_api
+def obs_frontend_get_current_transition():
+    return frontend['transition']
+
+
+@_api
+def obs_frontend_add_event_callback(callback):
+    frontend_callbacks.append(callback)
+
+
+@_api
+def obs_frontend_remove_event_callback(callback):
+    try:
+        frontend_callbacks.remove(callback)
+    except ValueError:
+        pass
+
+
+def frontend_event(event):
+    for callback in list(frontend_callbacks):
+        callback(event)
+
+
+# Properties.
+
+class _Property:
+
+    def __init__(self, name, description, kind):
+        self.name = name
+        self.description = description
+        self.kind = kind
+        self.enabled = True
+        self.visible = True
+        self.items = []
+        self.callback = None
+
+
+class _Properties(dict):
+    pass
+
+
+@_api
+def obs_properties_create():
+    return _Properties()
+
+
+def _add(props, name, description, kind):
+    p = props[name] = _Property(name, description, kind)
+    return p
+
+
+@_api
+def obs_properties_add_bool(props, name, description):
+    return _add(props, name, description, 'bool')
+
+
+@_api
+def obs_properties_add_int(props, name, description, min, max, step):
+    return _add(props, name, description, 'int')
+
+
+@_api
+def obs_properties_add_text(props, name, description, type):
+    return _add(props, name, description, 'text')
+
+
+@_api
+def obs_properties_add_list(props, name, description, type, format):
+    return _add(props, name, description, 'list')
+
+
+@_api
+def obs_properties_add_button(props, name, text, callback):
+    p = _add(props, name, text, 'button')
+    p.callback = callback
+    return p
+
+
+@_api
+def obs_properties_add_group(props, name, description, type, group):
+    p = _add(props, name, description, 'group')
+    p.group = group
+    return p
+
+
+@_api
+def obs_properties_get(props, name):
+    if name in props:
+        return props[name]
+    for p in props.values():
+        if p.kind == 'group' and name in p.group:
+            return p.group[name]
+
+
+@_api
+def obs_properties_apply_settings(props, settings):
+    pass
+
+
+@_api
+def obs_property_name(p):
+    return p.name
+
+
+@_api
+def obs_property_set_enabled(p, enabled):
+    p.enabled = enabled
+
+
+@_api
+def obs_property_set_visible(p, visible):
+    p.visible = visible
+
+
+@_api
+def obs_property_set_description(p, description):
+    p.description = description
+
+
+@_api
+def obs_property_set_long_description(p, description):
+    pass
+
+
+@_api
+def obs_property_set_modified_callback(p, callback):
+    p.callback = callback
+
+
+@_api
+def obs_property_list_clear(p):
+    p.items.clear()
+
+
+@_api
+def obs_property_list_add_string(p, label, value):
+    p.items.append((label, value))
+
+
+# Scripting.
+
+log = []
+timers = []
+
+
+@_api
+def script_log(level, message):
+    log.append((level, message))
+
+
+@_api
+def timer_add(callback, ms):
+    timers.append((callback, ms))
+
+
+@_api
+def timer_remove(callback):
+    timers[:] = [x for x in timers if x[0] != callback]
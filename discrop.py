@@ -1,18 +1,25 @@
-import asyncio
+import collections
+import functools
+import json
 import math
 import os.path
+import re
+import subprocess
 import sys
-import time
+import tempfile
 import threading
+import time
 import webbrowser
 
 import obspython as obs
 
+from discrop_shared import CALLS, Roster, RosterBlock, Stats, stats, timed
+
 script_path_ = os.path.dirname(__file__) # script_path is part of the OBS script interface.
-sys.path.append(os.path.join(script_path_, 'lib', 'site-packages'))
-import discord
 
 SLOTS = 10 # Seems to be the maximum people allowed.
+CONNECTING = '(connecting to Discord…)'
+CACHE = '.discrop_cache.json' # Alongside .bot_token.
 
 # Discord call window measurements.
 TITLE_BAR = 22
@@ -23,79 +30,486 @@ CALLER_ASPECT = 16 / 9
 CALLER_SPACING = 8
 CALLER_BORDER = 3 # Inwards border when caller is talking.
 
+# Reused for every OBS call that takes these, as OBS copies them anyway.
+CROP = obs.obs_sceneitem_crop()
+SCALE = obs.vec2()
+BOUNDS = obs.vec2()
+
 client = None
-thread = None
 settings = obs.obs_data_create()
-discord_source = None
+settings_generation = 0
+settings_state = None # Everything read_settings() parsed, to tell whether the settings changed at all as far as the scenes are concerned.
+tick_state = None
+applying = False
+scene_sources = []
+scene_index = []
+scene_index_dirty = True
+index_generation = 0
+active_scenes_only = False
+on_screen = None # Names of the program and preview scenes, and of the one being transitioned away from.
+shown_scenes = collections.deque() # Stale index entries whose scene started showing, for the tick to catch up. Appending and popping are thread-safe.
+transition = None # Current transition source, whose start is the first sign of a scene switch.
+
+
+class RemoteClient:
+    """Stands in for discrop_client.Client when it runs in a separate process, so that OBS’s Python doesn’t even import discord.py.
+
+    Rosters are read straight from a RosterBlock every frame, and everything else goes through the process’s stdin and stdout.
+    """
+
+    TIMEOUT = 5 # s, for the process to hand over its cache when stopping.
+    QUERY_TIMEOUT = 0.25 # s, for queries from the properties view, which runs on OBS’s UI thread.
+
+    def __init__(self, lean=False):
+        self.lean = lean
+        self.rosters = {}
+        self.live = False
+        self.trace = None
+        self._ready = False
+        self._cache = {} # What warm_start() got, until the process hands over its own when stopping.
+        self._picked = None
+        self._channel_labels = None # Sent over by the process whenever they change, so that the properties view never waits for them.
+        self._channel_guilds = {}
+        self._invite_url = None # Sent over along with the ready state.
+        self._answers = {} # Command -> (arguments, result) of the latest reply, even one that came too late, to fall back on.
+        self._seq = 0
+        self._process = None
+        self._block = None
+        self._block_path = None
+        self._queue = [] # Commands until the process is started.
+        self._lock = threading.RLock()
+        self._replies = {} # Request ID -> [event, result, command, arguments]
+        self._next_id = 0
+
+    def start(self, token):
+        fd, self._block_path = tempfile.mkstemp(prefix='discrop-', suffix='.roster')
+        os.close(fd)
+        self._block = RosterBlock.create(self._block_path)
+        self._process = subprocess.Popen(
+            [python_executable(), '-u', os.path.join(script_path_, 'discrop_client.py')],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True,
+            creationflags=getattr(subprocess, 'CREATE_NO_WINDOW', 0), # No console window popping up on Windows.
+        )
+        queue, self._queue = self._queue, None
+        self._send(token=token, lean=self.lean, block=self._block_path)
+        for message in queue:
+            self._send(**message)
+        threading.Thread(target=self._listen, daemon=True).start()
+        threading.Thread(target=self._log_errors, daemon=True).start()
+
+    def stop(self):
+        cache = self._request('stop', timeout=self.TIMEOUT)
+        if cache is not None:
+            self._cache = cache
+        try:
+            self._process.wait(self.TIMEOUT)
+        except subprocess.TimeoutExpired:
+            self._process.kill()
+        self._block.close()
+        os.remove(self._block_path)
+
+    def _send(self, **message):
+        with self._lock:
+            if self._queue is not None:
+                self._queue.append(message)
+                return
+            try:
+                self._process.stdin.write(json.dumps(message) + '\n')
+                self._process.stdin.flush()
+            except OSError: # It’s gone, which _listen() will have noticed.
+                pass
+
+    def _request(self, command, *args, timeout=QUERY_TIMEOUT):
+        if not self._process or self._process.poll() is not None:
+            return None
+        args = list(args) # As they come back from JSON, to compare them with the answers’.
+        with self._lock:
+            self._next_id += 1
+            request_id = self._next_id
+            reply = self._replies[request_id] = [threading.Event(), None, command, args]
+            self._send(command=command, id=request_id, **({'args': args} if args else {}))
+        if reply[0].wait(timeout):
+            return reply[1]
+        # Left for _listen() to pick up whenever it comes, so that asking again has it at hand.
+        obs.script_log(obs.LOG_WARNING, f'The Discord process didn’t answer in time ({command}).')
+        with self._lock:
+            answer = self._answers.get(command)
+        return answer[1] if answer and answer[0] == args else None
+
+    def _listen(self):
+        for line in self._process.stdout:
+            try:
+                message = json.loads(line)
+            except ValueError:
+                message = None
+            if not isinstance(message, dict):
+                obs.script_log(obs.LOG_WARNING, 'Discord process: ' + line.rstrip())
+            elif 'ready' in message:
+                self._invite_url = message.get('invite_url')
+                self._ready = message['ready']
+                self.live = self.live or self._ready
+            elif 'channels' in message:
+                self._channel_guilds = {int(x): y for x, y in message['guilds']}
+                self._channel_labels = message['channels']
+            elif 'id' in message:
+                with self._lock:
+                    reply = self._replies.pop(message['id'], None)
+                    if reply:
+                        reply[1] = message['result']
+                        self._answers[reply[2]] = (reply[3], reply[1])
+                if reply:
+                    reply[0].set()
+        self._ready = False
+        with self._lock:
+            for event, *_ in self._replies.values():
+                event.set()
+            self._replies.clear()
+
+    def _log_errors(self):
+        for line in self._process.stderr:
+            obs.script_log(obs.LOG_WARNING, 'Discord process: ' + line.rstrip())
+
+    def poll(self):
+        # Just a number to read, most of the time.
+        if self._block.sequence() != self._seq:
+            result = self._block.read(self.rosters)
+            if result:
+                self._seq, self.rosters = result
+
+    def is_ready(self):
+        return self._ready
+
+    def watch(self, channels):
+        self._send(command='watch', channels=list(channels))
+
+    def pick(self, uids):
+        uids = sorted(uids)
+        if uids != self._picked:
+            self._picked = uids
+            self._send(command='pick', uids=uids)
+
+    def warm_start(self, cache):
+        self._cache = cache
+        self._send(command='warm_start', cache=cache)
+
+    def cache(self):
+        """What the process handed over when stopped, or failing that, what it was started with."""
+        return self._cache
+
+    def record(self, path):
+        self.trace = path
+        self._send(command='record', path=path)
+
+    def trace_event(self, kind, **fields):
+        self._send(command='trace_event', kind=kind, fields=fields)
 
+    @property
+    def channel_labels(self):
+        return self._channel_labels
 
-class Client(discord.Client):
+    def channel_guild(self, channel_id):
+        return self._channel_guilds.get(channel_id)
 
-    def __init__(self):
-        super().__init__(intents=discord.Intents(guilds=True, members=True, voice_states=True))
-        self.audio = []
-        self.video = []
-        self._audio = {}
-        self._video = {}
-        self._channel = None
+    def member_picks(self, guild_id, channel_id, uids, search=''):
+        return self._request('member_picks', guild_id, channel_id, uids, search)
 
     @property
-    def channel(self):
-        return self._channel
-
-    @channel.setter
-    def channel(self, channel):
-        if (channel and not self._channel) or (self.channel and channel != self._channel.id):
-            self._audio.clear()
-            self._video.clear()
-            self._channel = self.get_channel(channel)
-            if self._channel:
-                for member in self._channel.members:
-                    if member.voice.self_video:
-                        self._video[member.id] = member.display_name
-                    else:
-                        self._audio[member.id] = member.display_name
-            else:
-                self._channel = None
-            self.sort()
-
-    async def on_member_update(self, before, after):
-        if not self.channel:
+    def invite_url(self):
+        return self._invite_url
+
+
+class Slot:
+    """Discord item and the item right below it, along with what was last applied to them, so that only actual changes reach OBS."""
+
+    def __init__(self, item):
+        self.item = item
+        self.below = None
+        self.visible = None
+        self.below_visible = None
+        self.transform = None # (crop, scale, bounds, bounds type, bounds alignment), or None to read it from the item.
+
+    def set_visible(self, visible):
+        if visible != self.visible:
+            obs.obs_sceneitem_set_visible(self.item, visible)
+            self.visible = visible
+            stats.setters += 1
+
+    def set_below_visible(self, visible):
+        if visible != self.below_visible:
+            obs.obs_sceneitem_set_visible(self.below, visible)
+            self.below_visible = visible
+            stats.setters += 1
+
+    def read_transform(self):
+        obs.obs_sceneitem_get_crop(self.item, CROP)
+        obs.obs_sceneitem_get_scale(self.item, SCALE)
+        obs.obs_sceneitem_get_bounds(self.item, BOUNDS)
+        self.transform = (
+            (CROP.left, CROP.top, CROP.right, CROP.bottom),
+            (SCALE.x, SCALE.y),
+            (BOUNDS.x, BOUNDS.y),
+            obs.obs_sceneitem_get_bounds_type(self.item),
+            obs.obs_sceneitem_get_bounds_alignment(self.item),
+        )
+
+    def set_transform(self, crop, scale, bounds):
+        transform = (crop, scale, bounds, obs.OBS_BOUNDS_SCALE_OUTER, 0) # obs.OBS_ALIGN_CENTER doesn’t seem to be implemented.
+        if transform == self.transform:
             return
-        if before.display_name != after.display_name and (before.voice and before.voice.channel == self.channel) or (after.voice and after.voice.channel == self.channel):
-            # before.id == after.id (duh), so it doesn’t matter which one we use.
-            if before.id in self._audio:
-                self._audio[after.id] = after.display_name
-            elif before.id in self._video:
-                self._video[after.id] = after.display_name
-            self.sort()
-
-    async def on_voice_state_update(self, member, before, after):
-        if not self.channel:
+        _crop, _scale, _bounds, bounds_type, alignment = self.transform
+        obs.obs_sceneitem_defer_update_begin(self.item) # So that OBS recalculates the transform only once.
+        if bounds != _bounds:
+            obs.vec2_set(BOUNDS, *bounds)
+            obs.obs_sceneitem_set_bounds(self.item, BOUNDS)
+            stats.setters += 1
+        if bounds_type != obs.OBS_BOUNDS_SCALE_OUTER:
+            obs.obs_sceneitem_set_bounds_type(self.item, obs.OBS_BOUNDS_SCALE_OUTER)
+            stats.setters += 1
+        if alignment != 0:
+            obs.obs_sceneitem_set_bounds_alignment(self.item, 0)
+            stats.setters += 1
+        if crop != _crop:
+            CROP.left, CROP.top, CROP.right, CROP.bottom = crop
+            obs.obs_sceneitem_set_crop(self.item, CROP)
+            stats.setters += 1
+        if scale != _scale:
+            obs.vec2_set(SCALE, *scale)
+            obs.obs_sceneitem_set_scale(self.item, SCALE)
+            stats.setters += 1
+        obs.obs_sceneitem_defer_update_end(self.item)
+        self.transform = transform
+
+    def changed(self, below=False):
+        """Whether the item, or the one right below, isn’t the way it was last left anymore. OBS signals our own changes too, and since
+        OBS 27 only flags them until the scene renders, so that the signals come long after they were applied."""
+        if below:
+            return self.below_visible is not None and obs.obs_sceneitem_visible(self.below) != self.below_visible
+        if self.visible is not None and obs.obs_sceneitem_visible(self.item) != self.visible:
+            return True
+        applied = self.transform
+        if not applied:
+            return False
+        self.read_transform()
+        if not same_transform(applied, self.transform):
+            return True
+        self.transform = applied # What we set, rather than how OBS rounded it, so that the next layout compares against the same thing.
+        return False
+
+    def forget(self):
+        self.visible = None
+        self.below_visible = None
+        self.transform = None
+
+
+class SceneIndex:
+    """Discord items of a scene, kept up to date through the scene’s signals instead of enumerating it every frame."""
+
+    SIGNALS = ('item_add', 'item_remove', 'reorder', 'refresh')
+    ITEM_SIGNALS = ('item_transform', 'item_visible')
+
+    def __init__(self, source):
+        self.source = source # Referenced by the list it came from, which is released along with the index.
+        self.scene = obs.obs_scene_from_source(source) # Shouldn’t be released.
+        self.name = obs.obs_source_get_name(source)
+        self.items = []
+        self.nested = [] # Names of the scenes added to this one as items.
+        self.slots = [] # Per call, from the top of the scene.
+        self.ids = {} # Item ID -> (slot it belongs to, whether it’s the one right below), for both Discord items and the ones right below.
+        self.discord_sources = ()
+        self.dirty = True
+        self.stale = False # Whether it missed changes while off screen, with only the scenes on screen kept up to date.
+        # Signal handlers need the very same callables to disconnect them.
+        self._invalidate = self.invalidate
+        self._item_changed = self.item_changed
+        self._renamed = self.renamed
+        self._shown = self.shown
+        self.signals = obs.obs_source_get_signal_handler(source)
+        for signal in self.SIGNALS:
+            obs.signal_handler_connect(self.signals, signal, self._invalidate)
+        for signal in self.ITEM_SIGNALS:
+            obs.signal_handler_connect(self.signals, signal, self._item_changed)
+        obs.signal_handler_connect(self.signals, 'rename', self._renamed)
+        obs.signal_handler_connect(self.signals, 'show', self._shown)
+
+    def invalidate(self, calldata=None):
+        global index_generation
+        self.dirty = True
+        index_generation += 1
+
+    def item_changed(self, calldata):
+        global index_generation
+        if applying: # Our own changes.
             return
-        if before.channel == self.channel and after.channel == self.channel:
-            if before.self_video and not after.self_video:
-                self._video.pop(member.id, None)
-                self._audio[member.id] = member.display_name
-            if not before.self_video and after.self_video:
-                self._audio.pop(member.id, None)
-                self._video[member.id] = member.display_name
-        elif before.channel == self.channel:
-            self._audio.pop(member.id, None)
-            self._video.pop(member.id, None)
-        elif after.channel == self.channel:
-            if after.self_video:
-                self._video[member.id] = member.display_name
-            else:
-                self._audio[member.id] = member.display_name
-        else:
+        slot, below = self.ids.get(obs.obs_sceneitem_get_id(obs.calldata_sceneitem(calldata, 'item')), (None, False))
+        if slot and slot.changed(below):
+            # Someone else touched it (e.g. moved or resized it in the UI), so what we last applied can’t be trusted anymore.
+            slot.forget()
+            index_generation += 1
+
+    def renamed(self, calldata):
+        # Scenes are told apart by name when working out which are on screen, nested ones included.
+        global scene_index_dirty
+        global on_screen
+        global index_generation
+        scene_index_dirty = True
+        on_screen = None
+        index_generation += 1
+
+    def shown(self, calldata):
+        # Also when it shows up with no frontend event telling, e.g. in a projector or the multiview. Not necessarily on the tick’s thread.
+        if self.stale:
+            shown_scenes.append(self)
+
+    def misses(self, sources, dirty):
+        """Whether applying the dirty bindings would have reached any of its items, had it been on screen. Unknown until it’s indexed again
+        after changing, so it counts as yes then."""
+        return self.dirty or sources != self.discord_sources or any(self.slots[x.number] for x in dirty)
+
+    def update(self, sources):
+        # A single pass over the scene sorts out the items of every call’s source.
+        if not self.dirty and sources == self.discord_sources:
             return
-        self.sort()
-
-    def sort(self):
-        # Discord sorts ‘ ’ before EOF, e.g. ‘foo bar’ > ‘foo’. Python doesn’t, but we can leverage the fact that ‘ ’ goes right before ‘!’.
-        self.audio = sorted(self._audio, key=lambda x: self._audio[x].lower() + '!')
-        self.video = sorted(self._video, key=lambda x: self._video[x].lower() + '!')
+        self.dirty = False # Before enumerating, so that changes made meanwhile aren’t missed.
+        self.discord_sources = sources
+        obs.sceneitem_list_release(self.items)
+        self.items = obs.obs_scene_enum_items(self.scene)
+        self.slots = [[] for _ in sources]
+        self.ids = {}
+        self.nested = []
+        above = None
+        for item in reversed(self.items):
+            source = obs.obs_sceneitem_get_source(item) # Shouldn’t be released.
+            if obs.obs_source_get_id(source) == 'scene':
+                self.nested.append(obs.obs_source_get_name(source))
+            slot = None
+            for i, discord_source in enumerate(sources):
+                if discord_source and source == discord_source: # If two calls pick the same source, the first one gets it.
+                    slot = Slot(item)
+                    self.slots[i].append(slot)
+                    self.ids[obs.obs_sceneitem_get_id(item)] = (slot, False)
+                    break
+            if not slot and above:
+                above.below = item
+                self.ids[obs.obs_sceneitem_get_id(item)] = (above, True)
+            above = slot
+
+    def release(self):
+        for signal in self.SIGNALS:
+            obs.signal_handler_disconnect(self.signals, signal, self._invalidate)
+        for signal in self.ITEM_SIGNALS:
+            obs.signal_handler_disconnect(self.signals, signal, self._item_changed)
+        obs.signal_handler_disconnect(self.signals, 'rename', self._renamed)
+        obs.signal_handler_disconnect(self.signals, 'show', self._shown)
+        obs.sceneitem_list_release(self.items)
+        self.stale = False
+        self.items = []
+        self.nested = []
+        self.slots = []
+        self.ids = {}
+
+
+class Binding:
+    """One call’s settings (voice channel, capture source, participants) and what was last applied from them."""
+
+    def __init__(self, number):
+        self.number = number
+        self.channel = None
+        self.source_name = ''
+        self.source = None
+        self.full_screen = False
+        self.nonvideo = False
+        self.item_right_below = False
+        self.participants = (-1,) * SLOTS
+        self.myself = -1
+        self.state = None # (roster, source, width, height) last applied.
+        self.new_roster = False
+        self.rects = None
+        self.shown = 0
+
+    def key(self, name):
+        # The first call’s settings keep the names they had before there could be more than one.
+        return f'call{self.number + 1}_{name}' if self.number else name
+
+    def read(self, settings):
+        # Parsed here rather than on every tick.
+        try:
+            self.channel = int(obs.obs_data_get_string(settings, self.key('voice_channel')))
+        except ValueError:
+            self.channel = None
+        self.source_name = obs.obs_data_get_string(settings, self.key('discord_source'))
+        self.full_screen = obs.obs_data_get_bool(settings, self.key('full_screen'))
+        self.nonvideo = obs.obs_data_get_bool(settings, self.key('show_nonvideo_participants'))
+        self.item_right_below = not self.nonvideo and obs.obs_data_get_bool(settings, self.key('item_right_below'))
+        self.participants = tuple(int(obs.obs_data_get_string(settings, self.key(f'participant{i}')) or -1) for i in range(SLOTS))
+        self.myself = int(obs.obs_data_get_string(settings, self.key('myself')) or -1)
+        return (self.channel, self.source_name, self.full_screen, self.nonvideo, self.item_right_below, self.participants, self.myself)
+
+    def update_source(self):
+        if self.source_name != obs.obs_source_get_name(self.source):
+            obs.obs_source_release(self.source) # Doesn’t error even if self.source == None.
+            self.source = obs.obs_get_source_by_name(self.source_name)
+
+    def prepare(self, roster, force=False):
+        """Work out the call window layout, unless nothing changed since it was last applied. Returns whether to apply it."""
+        # NOTE: These are 0 when the source isn’t visible at all in the current scene. Not that it matters, but I was just weirded out by it until I got it.
+        source_width = obs.obs_source_get_width(self.source)
+        source_height = obs.obs_source_get_height(self.source)
+        state = (roster, self.source, source_width, source_height)
+        if state == self.state and not force:
+            return False
+        if client.trace and (not self.state or self.state[2:] != state[2:]):
+            client.trace_event('source', call=self.number, width=source_width, height=source_height)
+        self.new_roster = not self.state or roster is not self.state[0]
+        self.state = state
+
+        # Get Discord call layout distribution and caller size.
+        count = len(roster.video)
+        if self.nonvideo:
+            count += len(roster.audio)
+        if count == 1 and (not roster.audio or not roster.video and self.nonvideo):
+            count = 2 # Discord adds a call to action that occupies the same space as a second caller.
+        self.rects = layout(source_width, source_height, count, self.full_screen)
+        self.shown = len(roster.index) if self.nonvideo else len(roster.video)
+        return True
+
+    def apply(self, slots):
+        roster, _, source_width, source_height = self.state
+        rects = self.rects
+        shown = self.shown
+        for i, slot in enumerate(slots):
+            uid = self.participants[i] if i < SLOTS else -1
+            index = roster.index.get(uid, shown)
+            visible = index < shown
+            slot.set_visible(visible)
+            if visible and rects:
+                if not slot.transform:
+                    slot.read_transform()
+                crop, scale, bounds, bounds_type, _ = slot.transform
+
+                # If item was set to not use a bounding box policy, calculate it from its other transform properties.
+                if bounds_type == obs.OBS_BOUNDS_NONE:
+                    bounds = (scale[0] * (source_width - crop[2] - crop[0]), scale[1] * (source_height - crop[3] - crop[1]))
+
+                # Make sure the crop doesn’t overflow the item bounds.
+                crop = caller_crop(source_width, source_height, rects[index], bounds[0] / bounds[1])
+
+                sx = abs(scale[0])
+                if uid == self.myself and uid in roster.video_uids:
+                    sx = -sx
+                slot.set_transform(crop, (sx, scale[1]), bounds)
+            if slot.below and self.item_right_below:
+                slot.set_below_visible(uid in roster.audio_uids)
+
+    def release(self):
+        obs.obs_source_release(self.source)
+        self.source = None
+        self.state = None
+
+
+NO_ROSTER = Roster() # For calls whose channel isn’t available (yet).
+bindings = tuple(Binding(x) for x in range(CALLS))
+active = bindings[:1] # The ones the user asked for.
+UI_ONLY = ('stats_summary',) + tuple(x.key('participant_search') for x in bindings) # Settings only there for the properties view to show.
 
 
 def script_description(): # OBS script interface.
@@ -104,38 +518,60 @@ def script_description(): # OBS script interface.
 
 def script_load(_settings): # OBS script interface.
     global client
-    global thread
-    global settings
-    settings = _settings
+    read_settings(_settings)
+
+    obs.obs_frontend_add_event_callback(frontend_event)
+    connect_transition() # Only does anything when the script is loaded after OBS has finished loading.
+
+    lean = obs.obs_data_get_bool(settings, 'lean_gateway')
+    if obs.obs_data_get_bool(settings, 'separate_process') and python_executable():
+        client = RemoteClient(lean)
+    else:
+        if obs.obs_data_get_bool(settings, 'separate_process'):
+            obs.script_log(obs.LOG_WARNING, 'Couldn’t find a Python program to run Discord in a separate process, so it’s running within OBS.')
+        from discrop_client import Client # Only then, since it imports discord.py.
+        client = Client(lean)
+    client.warm_start(load_cache())
+    with open(os.path.join(script_path_, '.bot_token')) as f: # script_path() is part of the OBS script interface.
+        client.start(f.read().rstrip())
 
-    if asyncio.get_event_loop().is_closed():
-        asyncio.set_event_loop(asyncio.new_event_loop())
 
-    client = Client()
-    with open(os.path.join(script_path_, '.bot_token')) as f: # script_path() is part of the OBS script interface.
-        thread = threading.Thread(target=client.run, args=(f.read().rstrip(),))
-        thread.start()
+def script_defaults(_settings): # OBS script interface.
+    obs.obs_data_set_default_int(_settings, 'calls', 1)
 
 
 def script_update(_settings): # OBS script interface.
-    global settings
-    settings = _settings
+    changed = read_settings(_settings)
+
+    recording = obs.obs_data_get_bool(settings, 'record_trace')
+    started = recording != bool(client.trace) and recording
+    if recording != bool(client.trace):
+        client.record(os.path.join(script_path_, time.strftime('discrop-trace-%Y%m%d-%H%M%S.jsonl')) if recording else None)
+    if client.trace and (changed or started):
+        _settings = json.loads(obs.obs_data_get_json(settings))
+        for name in UI_ONLY:
+            _settings.pop(name, None)
+        client.trace_event('settings', settings=_settings)
+
+    # If the client isn’t ready yet, it will pick the channels once it is.
+    client.watch(x.channel for x in active if x.channel)
+    client.pick({x for binding in active for x in binding.participants + (binding.myself,) if x != -1})
 
-    while not client.is_ready():
-        time.sleep(0.1)
-    try:
-        client.channel = int(obs.obs_data_get_string(settings, 'voice_channel'))
-    except ValueError:
-        pass
+
+def script_save(_settings): # OBS script interface.
+    for name in UI_ONLY:
+        obs.obs_data_erase(_settings, name) # Not worth keeping in the scene collection.
 
 
 def script_properties(): # OBS script interface.
     props = obs.obs_properties_create()
 
-    grp = obs.obs_properties_create()
-    p = obs.obs_properties_add_bool(grp, 'help', 'Help')
-    obs.obs_property_set_enabled(p, False)
-    obs.obs_property_set_long_description(p, '''<p>This script automatically maps Discord video calls into the scene’s layout.</p>
+    for binding in bindings:
+        grp = obs.obs_properties_create()
+        if not binding.number:
+            p = obs.obs_properties_add_bool(grp, 'help', 'Help')
+            obs.obs_property_set_enabled(p, False)
+            obs.obs_property_set_long_description(p, '''<p>This script automatically maps Discord video calls into the scene’s layout.</p>
 <h3>Discord instructions</h3>
 <ol>
   <li>In the voice channel where the call is happening, go to the bottom-right corner and select <em>Pop Out.</em></li>
@@ -153,256 +589,535 @@ def script_properties(): # OBS script interface.
 <h3>Using this script</h3>
 <ol>
   <li>Clicking on <em>Bot invite link</em> will take to a Discord webpage where you can invite your bot to any of your servers with the right permissions, or you can copy the URL and share it with someone who owns another server too.</li>
+  <li>If you’re capturing more than one call at once (each in its own window and capture source), set <em>Number of calls</em> accordingly, and follow the next steps for each of them in its own section.</li>
   <li>Open the dropdown menu below, and pick the voice channel you’re in.</li>
   <li>Tick the <em>Full Screen</em> and <em>Show Non-Video Participants</em> checkboxes according to the state of your Discord call (on Discord, <em>Show Non-Video Participants</em> is located under the three dots button at the top right of the call window).</li>
   <li>Open the next dropdown menu, and pick the source that’s capturing the Discord call. <strong>CAUTION: this will irreversibly modify all items belonging to the source you pick! Moreover, the script knows which items to modify based on their source’s name alone, so please avoid changing your sources’ names to prevent unexpected behaviour.</strong></li>
   <li>If <em>Show Non-Video Participants</em> is off, you can tick <em>Show/hide item right below for audio-only.</em> This requires an item right below each Discord item, which the script will show when the participant has no video, and hide otherwise.</li>
   <li>Pick yourself in the <em>Myself</em> list, so that you appear un-mirrored to the rest of the world while your video is on.</li>
-  <li>Choose every participant you want to appear in your scene <strong>(including yourself).</strong> Follow the same order you used with your Discord items in the <em>Sources</em> panel.</li>
+  <li>Choose every participant you want to appear in your scene <strong>(including yourself).</strong> Follow the same order you used with your Discord items in the <em>Sources</em> panel. In big servers, only those in the call are listed at first: type the beginning of anyone else’s name in <em>Search</em> and click <em>Refresh names.</em></li>
   <li><strong>If you’re in <em>Studio Mode,</em> click on the gear icon between both views, and make sure <em>Duplicate Scene</em> is OFF!</strong></li>
 </ol>''')
 
-    p = obs.obs_properties_add_button(grp, 'bot_invite_link', 'Bot invite link', bot_invite)
-    obs.obs_property_set_long_description(p, '<p>Go to a Discord webpage that lets you invite your bot into any of your servers with the right permissions. You can share this URL with the owner of another server so they invite it for you.</p>')
-
-    p = obs.obs_properties_add_list(grp, 'voice_channel', 'Voice channel', obs.OBS_COMBO_TYPE_LIST, obs.OBS_COMBO_FORMAT_STRING)
-    obs.obs_property_set_modified_callback(p, populate_participants)
-    obs.obs_property_set_long_description(p, '<p>Discord server and voice/video channel where the call is happening.</p>')
-    p = obs.obs_properties_add_button(grp, 'refresh_channels', 'Refresh channels', populate_channels)
-    obs.obs_property_set_long_description(p, '<p>Rebuild the list of channels above. Useful for when you’ve just invited the bot to a server, or a new channel has been created in one of the servers it’s invited to. Don’t worry— it won’t reset your choice, unless it’s no longer available.</p>')
-
-    p = obs.obs_properties_add_bool(grp, 'full_screen', 'Full-screen')
-    obs.obs_property_set_long_description(p, '<p>Whether the Discord call window is in <em>Full Screen</em> mode</p>')
-    p = obs.obs_properties_add_bool(grp, 'show_nonvideo_participants', 'Show Non-Video Participants')
-    obs.obs_property_set_modified_callback(p, show_nonvideo_participants_callback)
-    obs.obs_property_set_long_description(p, '<p>Whether the Discord call window has <em>Show Non-video Participants</em> on (under the three dots button at the top right corner)</p>')
-
-    p = obs.obs_properties_add_list(grp, 'discord_source', 'Discord source', obs.OBS_COMBO_TYPE_LIST, obs.OBS_COMBO_FORMAT_STRING)
-    obs.obs_property_set_long_description(p, '<p>Source that is capturing the Discord call. <strong>CAUTION: this will irreversibly modify all items belonging to the source you pick!</strong></p>')
-    p = obs.obs_properties_add_button(grp, 'refresh_sources', 'Refresh sources', populate_sources)
-    obs.obs_property_set_long_description(p, '<p>Rebuild the list of sources above. Useful for when you’ve made major changes to your scenes. This won’t reset your choice, unless it’s no longer available.</p>')
-    p = obs.obs_properties_add_bool(grp, 'item_right_below', 'Show/hide item right below for audio-only')
-    obs.obs_property_set_long_description(p, '<p>Requires an item right below each Discord item, which the script will show when the participant has no video, and hide otherwise</p>')
-
-    obs.obs_properties_add_group(props, 'general', 'General', obs.OBS_GROUP_NORMAL, grp)
+            p = obs.obs_properties_add_button(grp, 'bot_invite_link', 'Bot invite link', bot_invite)
+            obs.obs_property_set_long_description(p, '<p>Go to a Discord webpage that lets you invite your bot into any of your servers with the right permissions. You can share this URL with the owner of another server so they invite it for you.</p>')
+
+            p = obs.obs_properties_add_int(grp, 'calls', 'Number of calls', 1, CALLS, 1)
+            obs.obs_property_set_modified_callback(p, calls_callback)
+            obs.obs_property_set_long_description(p, '<p>How many Discord calls you’re capturing, each from its own window into its own source. They all go through the same bot.</p>')
+
+        p = obs.obs_properties_add_list(grp, binding.key('voice_channel'), 'Voice channel', obs.OBS_COMBO_TYPE_LIST, obs.OBS_COMBO_FORMAT_STRING)
+        obs.obs_property_set_modified_callback(p, populate_participants)
+        obs.obs_property_set_long_description(p, '<p>Discord server and voice/video channel where the call is happening.</p>')
+        p = obs.obs_properties_add_button(grp, binding.key('refresh_channels'), 'Refresh channels', populate_channels)
+        obs.obs_property_set_long_description(p, '<p>Rebuild the list of channels above. Useful for when you’ve just invited the bot to a server, or a new channel has been created in one of the servers it’s invited to. Don’t worry— it won’t reset your choice, unless it’s no longer available.</p>')
+
+        p = obs.obs_properties_add_bool(grp, binding.key('full_screen'), 'Full-screen')
+        obs.obs_property_set_long_description(p, '<p>Whether the Discord call window is in <em>Full Screen</em> mode</p>')
+        p = obs.obs_properties_add_bool(grp, binding.key('show_nonvideo_participants'), 'Show Non-Video Participants')
+        obs.obs_property_set_modified_callback(p, show_nonvideo_participants_callback)
+        obs.obs_property_set_long_description(p, '<p>Whether the Discord call window has <em>Show Non-video Participants</em> on (under the three dots button at the top right corner)</p>')
+
+        p = obs.obs_properties_add_list(grp, binding.key('discord_source'), 'Discord source', obs.OBS_COMBO_TYPE_LIST, obs.OBS_COMBO_FORMAT_STRING)
+        obs.obs_property_set_long_description(p, '<p>Source that is capturing the Discord call. <strong>CAUTION: this will irreversibly modify all items belonging to the source you pick!</strong></p>')
+        p = obs.obs_properties_add_button(grp, binding.key('refresh_sources'), 'Refresh sources', populate_sources)
+        obs.obs_property_set_long_description(p, '<p>Rebuild the list of sources above. Useful for when you’ve made major changes to your scenes. This won’t reset your choice, unless it’s no longer available.</p>')
+        p = obs.obs_properties_add_bool(grp, binding.key('item_right_below'), 'Show/hide item right below for audio-only')
+        obs.obs_property_set_long_description(p, '<p>Requires an item right below each Discord item, which the script will show when the participant has no video, and hide otherwise</p>')
+
+        if not binding.number:
+            p = obs.obs_properties_add_bool(grp, 'active_scenes_only', 'Only update scenes on screen')
+            obs.obs_property_set_long_description(p, '<p>Only keep the program and preview scenes up to date with the calls, along with the scenes nested in them, and catch up with the rest as soon as they’re switched to. Makes frames cheaper when you have lots of scenes.</p>')
+            p = obs.obs_properties_add_bool(grp, 'separate_process', 'Run Discord in a separate process (requires reloading the script)')
+            obs.obs_property_set_long_description(p, '<p>Keep all Discord traffic away from OBS’s Python, so that busy servers can’t make frames take longer. Rosters are shared through memory, so changes in the calls show up just as fast. <em>Measure performance</em> only covers OBS’s side then.</p>')
+            p = obs.obs_properties_add_bool(grp, 'lean_gateway', 'Lean Discord connection (requires reloading the script)')
+            obs.obs_property_set_long_description(p, '<p>Don’t load the members of every server the bot is in on startup, only those of the servers whose voice channels are picked, when they’re picked. Makes the script ready sooner and use less memory when the bot is in several big servers.</p>')
+
+        obs.obs_properties_add_group(props, binding.key('general'), f'Call {binding.number + 1}' if binding.number else 'General', obs.OBS_GROUP_NORMAL, grp)
+
+        grp = obs.obs_properties_create()
+        p = obs.obs_properties_add_list(grp, binding.key('myself'), 'Myself', obs.OBS_COMBO_TYPE_LIST, obs.OBS_COMBO_FORMAT_STRING)
+        obs.obs_property_set_long_description(p, '<p>Participant whose video should be un-mirrored (yourself).</p>')
+        p = obs.obs_properties_add_text(grp, binding.key('participant_search'), 'Search', obs.OBS_TEXT_DEFAULT)
+        obs.obs_property_set_long_description(p, '<p>Beginning of the name of someone who isn’t in the call, to list them in the menus below once you click <em>Refresh names.</em> Only needed in big servers: otherwise everyone is listed anyway.</p>')
+        p = obs.obs_properties_add_button(grp, binding.key('refresh_names'), 'Refresh names', populate_participants)
+        obs.obs_property_set_long_description(p, '<p>Rebuild the participant lists with whoever is in the call, and whoever matches <em>Search.</em> Useful when there have been nickname changes, or someone has joined the server. Don’t worry— it won’t reset each choice, unless a selected participant left the server.</p>')
+        for i in range(SLOTS):
+            p = obs.obs_properties_add_list(grp, binding.key(f'participant{i}'), None, obs.OBS_COMBO_TYPE_LIST, obs.OBS_COMBO_FORMAT_STRING)
+            obs.obs_property_set_long_description(p, '<p>Participant to appear at the ' + ordinal(i + 1) + ' capture item from the top of the scene</p>')
+        obs.obs_properties_add_group(props, binding.key('participant_layout'), f'Call {binding.number + 1} participant layout' if binding.number else 'Participant layout', obs.OBS_GROUP_NORMAL, grp)
 
     grp = obs.obs_properties_create()
-    p = obs.obs_properties_add_list(grp, 'myself', 'Myself', obs.OBS_COMBO_TYPE_LIST, obs.OBS_COMBO_FORMAT_STRING)
-    obs.obs_property_set_long_description(p, '<p>Participant whose video should be un-mirrored (yourself).</p>')
-    p = obs.obs_properties_add_button(grp, 'refresh_names', 'Refresh names', populate_participants)
-    obs.obs_property_set_long_description(p, '<p>Rebuild the participant lists. Useful when there have been nickname changes, or someone has joined the server. Don’t worry— it won’t reset each choice, unless a selected participant left the server.</p>')
-    for i in range(SLOTS):
-        p = obs.obs_properties_add_list(grp, f'participant{i}', None, obs.OBS_COMBO_TYPE_LIST, obs.OBS_COMBO_FORMAT_STRING)
-        obs.obs_property_set_long_description(p, '<p>Participant to appear at the ' + ordinal(i + 1) + ' capture item from the top of the scene</p>')
-    obs.obs_properties_add_group(props, 'participant_layout', 'Participant layout', obs.OBS_GROUP_NORMAL, grp)
+    p = obs.obs_properties_add_bool(grp, 'instrumentation', 'Measure performance')
+    obs.obs_property_set_long_description(p, '<p>Time how long the script takes to update the scenes and to handle Discord events, count how many changes it makes to scene items, and how long a change in the call takes to show up. A summary is shown below and written to the script log every minute.</p>')
+    p = obs.obs_properties_add_text(grp, 'stats_summary', 'Summary', obs.OBS_TEXT_MULTILINE)
+    obs.obs_property_set_enabled(p, False)
+    p = obs.obs_properties_add_button(grp, 'refresh_stats', 'Refresh summary', refresh_stats)
+    p = obs.obs_properties_add_bool(grp, 'record_trace', 'Record Discord events')
+    obs.obs_property_set_long_description(p, '<p>Write every voice, member and channel event the script gets from Discord, with timestamps, into a <code>discrop-trace-….jsonl</code> file alongside <code>discrop.py,</code> to replay it later with <code>bench/replay.py.</code> It contains the names of everyone in the calls and servers involved, so be careful who you share it with.</p>')
+    obs.obs_properties_add_group(props, 'diagnostics', 'Diagnostics', obs.OBS_GROUP_NORMAL, grp)
 
+    # These don’t wait for Discord: until it’s connected, the lists just hold placeholders, which the refresh buttons replace.
     populate_sources(props)
-    while not client.is_ready():
-        time.sleep(0.1)
     populate_channels(props)
     populate_participants(props)
+    calls_callback(props, None, settings)
+    obs.obs_data_set_string(settings, 'stats_summary', stats.summary())
 
     obs.obs_properties_apply_settings(props, settings)
     return props
 
 
+@timed('script_tick')
 def script_tick(seconds): # OBS script interface.
-    global discord_source
+    global tick_state
 
-    source_name = obs.obs_data_get_string(settings, 'discord_source')
-    if source_name != obs.obs_source_get_name(discord_source):
-        obs.obs_source_release(discord_source) # Doesn’t error even if discord_source == None.
-        discord_source = obs.obs_get_source_by_name(source_name)
+    # The sources can only change along with the settings, unless they didn’t exist yet when they did.
+    state = (settings_generation, index_generation)
+    for binding in active:
+        if not binding.source or not tick_state or tick_state[0] != settings_generation:
+            binding.update_source()
 
     if not client:
         return
+    client.poll()
+
+    # Nothing to do unless a roster, the settings, the scenes or a call window size changed since the last time.
+    rosters = client.rosters
+    changed = state != tick_state
+    dirty = [x for x in active if x.prepare(rosters.get(x.channel, NO_ROSTER), changed)]
+    if dirty:
+        tick_state = state
+        stats.setters = 0
+
+        # Apply necessary changes to relevant scene items, in a single pass over the scenes for all calls.
+        entries = update_scene_index()
+        apply_changes(entries, dirty)
+        mark_stale(entries, dirty)
+
+        if stats.enabled:
+            stats.record('OBS setters per tick', stats.setters, 'calls')
+            for binding in dirty:
+                if binding.new_roster and binding.state[0] is not NO_ROSTER:
+                    stats.record('Discord event to scenes', time.perf_counter() - binding.state[0].time)
+
+    if shown_scenes:
+        catch_up()
+
+
+def apply_changes(entries, _bindings):
+    global applying
+    applying = True
+    try:
+        for entry in entries:
+            for binding in _bindings:
+                binding.apply(entry.slots[binding.number])
+    finally:
+        applying = False
+
+
+def mark_stale(applied, dirty):
+    """Flag the scenes that missed changes while off screen, for their show signal to catch them up."""
+    applied = set(applied)
+    sources = tuple(x.source for x in active)
+    for entry in scene_index:
+        if entry in applied:
+            entry.stale = False
+        elif not entry.stale and entry.misses(sources, dirty):
+            entry.stale = True # Before checking, so that its show signal can’t slip in between unnoticed.
+            if obs.obs_source_showing(entry.source): # Already showing somewhere, so no show signal will come.
+                shown_scenes.append(entry)
+
+
+def catch_up():
+    entries = []
+    while shown_scenes:
+        entry = shown_scenes.popleft()
+        if entry.stale: # Not caught up or released meanwhile.
+            entry.stale = False
+            entries.append(entry)
+    sources = tuple(x.source for x in active)
+    for entry in entries:
+        entry.update(sources)
+    apply_changes(entries, [x for x in active if x.state])
 
-    # NOTE: These are 0 when the source isn’t visible at all in the current scene. Not that it matters, but I was just weirded out by it until I got it.
-    source_width = obs.obs_source_get_width(discord_source)
-    source_height = obs.obs_source_get_height(discord_source)
 
-    margin_top = MARGIN_TOP
-    if not obs.obs_data_get_bool(settings, 'full_screen'):
-        margin_top = margin_top + TITLE_BAR
+def script_unload(): # OBS script interface.
+    obs.timer_remove(log_stats)
+    obs.obs_frontend_remove_event_callback(frontend_event)
+    disconnect_transition()
+    release_scene_index()
+    for binding in bindings:
+        binding.release()
 
-    # Get Discord call layout distribution and caller size.
-    people = [x for x in client.video] # Mutability and shiz.
-    nonvideo = obs.obs_data_get_bool(settings, 'show_nonvideo_participants')
-    if nonvideo:
-        people += client.audio
-    count = len(people)
-    if count == 1 and (not client.audio or not client.video and nonvideo):
-        count = 2 # Discord adds a call to action that occupies the same space as a second caller.
-    rows = None
-    cols = None
-    width = 0
-    height = None
-    offsetx = 0
-    offsety = 0
-    offset_last = None
-    if source_width and source_height:
-        totalw = source_width - MARGIN_SIDES * 2
-        totalh = source_height - margin_top - MARGIN_BTM
-        if totalw > 0 and totalh > 0:
-            wide = None
-            # Discord packs the callers in as many columns as possible, unless their videos appear bigger with fewer columns.
-            for c in reversed(range(1, count+1)):
-                r = math.ceil(count / c)
-                w = (totalw - CALLER_SPACING * (c - 1)) / c
-                h = (totalh - CALLER_SPACING * (r - 1)) / r
-                wi = w / h > CALLER_ASPECT
-                if wi:
-                    w = h * CALLER_ASPECT
-                if w > width:
-                    rows = r
-                    cols = c
-                    width = w
-                    height = h
-                    wide = wi
-            if rows:
-                # If the window is wider or taller than the callers fit in, Discord will center them as a whole.
-                inner_width = (width * cols + CALLER_SPACING * (cols - 1))
-                if wide: # Wider than needed, therefore center horizontally.
-                    offsetx = (totalw - inner_width) / 2
-                else: # Taller than needed, therefore center vertically.
-                    height = width / CALLER_ASPECT # We compared using widths only before, so height needs to be adjusted.
-                    offsety = (totalh - (height * rows + CALLER_SPACING * (rows - 1))) / 2
-
-                # If last row contains fewer callers than columns, Discord will center it.
-                offset_last = count % cols
-                if offset_last > 0:
-                    offset_last = (inner_width - (width * offset_last + CALLER_SPACING * (offset_last - 1))) / 2
-
-    # Apply necessary changes to relevant scene items.
-    scene_sources = obs.obs_frontend_get_scenes()
-    for scene_src in scene_sources:
-        scene = obs.obs_scene_from_source(scene_src) # Shouldn’t be released.
-        items = obs.obs_scene_enum_items(scene)
-        i = 0
-        next_vis = None
-        for item in reversed(items):
-            _next_vis = None
-            if obs.obs_sceneitem_get_source(item) == discord_source: # Shouldn’t be released.
-                uid = int(obs.obs_data_get_string(settings, f'participant{i}') or -1)
-                visible = True
-                try:
-                    index = people.index(uid)
-                except (IndexError, ValueError):
-                    visible = False
-                i += 1
-                obs.obs_sceneitem_set_visible(item, visible)
-                if visible and rows:
-                    crop = obs.obs_sceneitem_crop()
-                    obs.obs_sceneitem_get_crop(item, crop)
-                    scale = obs.vec2()
-                    obs.obs_sceneitem_get_scale(item, scale)
-                    bounds = obs.vec2()
-                    obs.obs_sceneitem_get_bounds(item, bounds)
-
-                    # If item was set to not use a bounding box policy, calculate it from its other transform properties.
-                    if obs.obs_sceneitem_get_bounds_type(item) == obs.OBS_BOUNDS_NONE:
-                        obs.vec2_set(bounds, scale.x * (source_width - crop.right - crop.left), scale.y * (source_height - crop.bottom - crop.top))
-                        obs.obs_sceneitem_set_bounds(item, bounds)
-
-                    obs.obs_sceneitem_set_bounds_type(item, obs.OBS_BOUNDS_SCALE_OUTER)
-                    obs.obs_sceneitem_set_bounds_alignment(item, 0) # obs.OBS_ALIGN_CENTER doesn’t seem to be implemented.
-
-                    # Get top left corner of this caller.
-                    r = math.ceil((index + 1) / cols)
-                    c = index % cols + 1
-                    x = MARGIN_SIDES + offsetx + (width + CALLER_SPACING) * (c - 1)
-                    if r == rows:
-                        x = x + offset_last
-                    y = margin_top + offsety + (height + CALLER_SPACING) * (r - 1)
-
-                    # Make sure the crop doesn’t overflow the item bounds.
-                    aspect = bounds.x / bounds.y
-                    clipx = 0
-                    clipy = 0
-                    if aspect > CALLER_ASPECT:
-                        clipy = (height - width / aspect) / 2
-                    else:
-                        clipx = (width - height * aspect) / 2
-
-                    crop.left = math.ceil(x + CALLER_BORDER + clipx)
-                    crop.top = math.ceil(y + CALLER_BORDER + clipy)
-                    crop.right = source_width - int(x + width - CALLER_BORDER - clipx)
-                    crop.bottom = source_height - int(y + height - CALLER_BORDER - clipy)
-                    obs.obs_sceneitem_set_crop(item, crop)
-
-                    sx = abs(scale.x)
-                    if uid == int(obs.obs_data_get_string(settings, 'myself') or -1) and uid in client.video:
-                        sx = -sx
-                    sy = scale.y
-                    obs.vec2_set(scale, sx, sy)
-                    obs.obs_sceneitem_set_scale(item, scale)
-                if not nonvideo and obs.obs_data_get_bool(settings, 'item_right_below'):
-                    _next_vis = uid in client.audio
-            elif next_vis is not None:
-                obs.obs_sceneitem_set_visible(item, next_vis)
-            next_vis = _next_vis
-        obs.sceneitem_list_release(items)
+    client.stop()
+    save_cache(client.cache())
+
+
+def read_settings(_settings):
+    """Parse the settings, and return whether they changed anything that matters to the scenes."""
+    global settings
+    global settings_generation
+    global settings_state
+    global active
+    global active_scenes_only
+    settings = _settings
+    state = tuple(x.read(settings) for x in bindings)
+    active = bindings[:calls_setting(settings)]
+    active_scenes_only = obs.obs_data_get_bool(settings, 'active_scenes_only')
+    # Values that only the properties view uses (see UI_ONLY) change on their own too, and shouldn’t have every scene applied again.
+    state += (len(active), active_scenes_only)
+    changed = state != settings_state
+    if changed:
+        settings_state = state
+        settings_generation += 1
+
+    enabled = obs.obs_data_get_bool(settings, 'instrumentation')
+    if enabled != stats.enabled:
+        stats.reset()
+        stats.enabled = enabled
+        if enabled:
+            obs.timer_add(log_stats, Stats.LOG_INTERVAL)
+        else:
+            obs.timer_remove(log_stats)
+    return changed
+
+
+def calls_setting(_settings):
+    return min(max(obs.obs_data_get_int(_settings, 'calls'), 1), CALLS)
+
+
+def python_executable():
+    """Python program to run the Discord client with in a separate process, as OBS’s own executable is OBS itself."""
+    for path in (
+        os.path.join(script_path_, 'Scripts', 'python.exe'), # The virtual environment the README suggests.
+        os.path.join(script_path_, 'bin', 'python'),
+        os.path.join(sys.exec_prefix, 'python.exe'), # The Python OBS is set to use.
+        os.path.join(sys.exec_prefix, 'bin', 'python3'),
+    ):
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def load_cache():
+    try:
+        with open(os.path.join(script_path_, CACHE), encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        obs.script_log(obs.LOG_WARNING, f'Couldn’t read {CACHE}, starting from scratch: {e}')
+        return {}
+
+
+def save_cache(cache):
+    path = os.path.join(script_path_, CACHE)
+    try:
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(cache, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(path + '.tmp', path) # So that it’s never left half-written.
+    except OSError as e:
+        obs.script_log(obs.LOG_WARNING, f'Couldn’t write {CACHE}: {e}')
+
+
+def frontend_event(event):
+    global scene_index_dirty
+    global index_generation
+    global on_screen
+    if event in (obs.OBS_FRONTEND_EVENT_SCENE_LIST_CHANGED, obs.OBS_FRONTEND_EVENT_SCENE_COLLECTION_CHANGED, obs.OBS_FRONTEND_EVENT_SCENE_COLLECTION_CLEANUP):
+        scene_index_dirty = True
+        on_screen = None
+        index_generation += 1
+    elif event in (obs.OBS_FRONTEND_EVENT_SCENE_CHANGED, obs.OBS_FRONTEND_EVENT_PREVIEW_SCENE_CHANGED, obs.OBS_FRONTEND_EVENT_TRANSITION_STOPPED, obs.OBS_FRONTEND_EVENT_STUDIO_MODE_ENABLED, obs.OBS_FRONTEND_EVENT_STUDIO_MODE_DISABLED, obs.OBS_FRONTEND_EVENT_FINISHED_LOADING):
+        # Transitions tell about the scene they’re switching to sooner (see transition_started), so this mostly catches the rest.
+        if update_on_screen(event) and active_scenes_only:
+            index_generation += 1
+    # Transitions belong to the scene collection.
+    if event in (obs.OBS_FRONTEND_EVENT_TRANSITION_CHANGED, obs.OBS_FRONTEND_EVENT_TRANSITION_LIST_CHANGED, obs.OBS_FRONTEND_EVENT_SCENE_COLLECTION_CHANGED, obs.OBS_FRONTEND_EVENT_FINISHED_LOADING):
+        connect_transition()
+
+
+def connect_transition():
+    global transition
+    disconnect_transition()
+    transition = obs.obs_frontend_get_current_transition()
+    if transition:
+        obs.signal_handler_connect(obs.obs_source_get_signal_handler(transition), 'transition_start', transition_started)
+
+
+def disconnect_transition():
+    global transition
+    if transition:
+        obs.signal_handler_disconnect(obs.obs_source_get_signal_handler(transition), 'transition_start', transition_started)
+    obs.obs_source_release(transition)
+    transition = None
+
+
+def transition_started(calldata):
+    # Before OBS_FRONTEND_EVENT_SCENE_CHANGED, which the UI only sends once it’s done switching, so that the scene
+    # switched to catches up as early as possible. The one switched from is still showing until the transition stops.
+    global on_screen
+    global index_generation
+    name = scene_name(obs.obs_transition_get_source(obs.calldata_source(calldata, 'source'), obs.OBS_TRANSITION_SOURCE_B))
+    if on_screen and name and name != on_screen[0]:
+        on_screen = (name, on_screen[1], on_screen[0])
+        if active_scenes_only:
+            index_generation += 1
+
+
+def update_scene_index():
+    """Bring the index up to date, and return the entries to apply changes to."""
+    global scene_index
+    global scene_index_dirty
+    global scene_sources
+    if scene_index_dirty:
+        scene_index_dirty = False
+        release_scene_index()
+        scene_sources = obs.obs_frontend_get_scenes() # Kept until the index is released, so that the scenes outlive their signal connections.
+        scene_index = [SceneIndex(x) for x in scene_sources]
+    sources = tuple(x.source for x in active)
+    if not active_scenes_only:
+        for entry in scene_index:
+            entry.update(sources)
+        return scene_index
+
+    # Only the scenes on screen, and those nested in them however deep. The rest are left stale until they show up, as
+    # that bumps index_generation, which has every call applied again to whichever scenes are on screen by then.
+    if on_screen is None:
+        update_on_screen()
+    by_name = {x.name: x for x in scene_index}
+    entries = []
+    names = [x for x in on_screen if x]
+    while names:
+        entry = by_name.pop(names.pop(), None) # Popped so that each scene is only visited once.
+        if entry:
+            entry.update(sources)
+            entries.append(entry)
+            names.extend(entry.nested)
+    return entries
+
+
+def update_on_screen(event=None):
+    """Find out which scenes are on screen. Returns whether that changed."""
+    global on_screen
+    program = scene_name(obs.obs_frontend_get_current_scene())
+    preview = scene_name(obs.obs_frontend_get_current_preview_scene()) # None unless in studio mode.
+    leaving = None
+    if on_screen and event == obs.OBS_FRONTEND_EVENT_SCENE_CHANGED and on_screen[0] != program:
+        leaving = on_screen[0] # Still showing until the transition is over.
+    elif on_screen and event != obs.OBS_FRONTEND_EVENT_TRANSITION_STOPPED:
+        leaving = on_screen[2]
+    previous = on_screen
+    on_screen = (program, preview, leaving)
+    return on_screen != previous
+
+
+def scene_name(source):
+    name = obs.obs_source_get_name(source)
+    obs.obs_source_release(source) # Doesn’t error even if source == None.
+    return name
+
+
+def release_scene_index():
+    global scene_index
+    global scene_sources
+    for entry in scene_index:
+        entry.release()
+    scene_index = []
+    shown_scenes.clear()
     obs.source_list_release(scene_sources)
+    scene_sources = []
 
 
-def script_unload(): # OBS script interface.
-    client.loop.call_soon_threadsafe(lambda: asyncio.ensure_future(client.close()))
-    thread.join()
+def bindings_of(p):
+    """Calls a property callback is about: the one whose section the property is in, or all of them."""
+    if not p:
+        return bindings
+    match = re.match(r'call(\d+)_', obs.obs_property_name(p))
+    number = int(match.group(1)) - 1 if match else 0
+    return bindings[number:number + 1]
+
+
+def calls_callback(props, p, _settings):
+    count = calls_setting(_settings)
+    for binding in bindings[1:]:
+        for name in ('general', 'participant_layout'):
+            obs.obs_property_set_visible(obs.obs_properties_get(props, binding.key(name)), binding.number < count)
+    return True
 
 
 def show_nonvideo_participants_callback(props, p, _settings):
-    obs.obs_property_set_enabled(obs.obs_properties_get(props, 'item_right_below'), not obs.obs_data_get_bool(_settings, 'show_nonvideo_participants'))
+    for binding in bindings_of(p):
+        obs.obs_property_set_enabled(obs.obs_properties_get(props, binding.key('item_right_below')), not obs.obs_data_get_bool(_settings, binding.key('show_nonvideo_participants')))
+    return True
+
+
+def refresh_stats(props, p=None):
+    obs.obs_data_set_string(settings, 'stats_summary', stats.summary())
     return True
 
 
+def log_stats():
+    obs.script_log(obs.LOG_INFO, 'Performance summary:\n' + stats.summary())
+
+
 def bot_invite(props, p=None, _settings=None):
-    while not client.is_ready():
-        time.sleep(0.1)
-    webbrowser.open_new_tab(discord.utils.oauth_url(client.user.id, discord.Permissions(connect=True)))
+    url = client.is_ready() and client.invite_url
+    if not url:
+        obs.script_log(obs.LOG_WARNING, 'Not connected to Discord yet, please try again in a few seconds.')
+        return False
+    webbrowser.open_new_tab(url)
 
 
+@timed('populate_channels')
 def populate_channels(props, p=None, _settings=None):
-    p = obs.obs_properties_get(props, 'voice_channel')
-    obs.obs_property_list_clear(p)
-    for guild in sorted(client.guilds, key=lambda x: x.name.lower()):
-        for channel in sorted(guild.channels, key=lambda x: x.position):
-            if isinstance(channel, discord.VoiceChannel):
-                obs.obs_property_list_add_string(p, guild.name + ' -> ' + channel.name, str(channel.id))
+    # Every call picks from the same channels, so refreshing one refreshes them all.
+    labels = client.channel_labels
+    for binding in bindings:
+        p = obs.obs_properties_get(props, binding.key('voice_channel'))
+        obs.obs_property_list_clear(p)
+        if labels is None:
+            # Keep showing the current choice somehow, rather than an empty menu.
+            obs.obs_property_list_add_string(p, CONNECTING, obs.obs_data_get_string(_settings or settings, binding.key('voice_channel')))
+            continue
+        for label, channel in labels:
+            obs.obs_property_list_add_string(p, label, channel)
     return True
 
 
+@timed('populate_sources')
 def populate_sources(props, p=None, _settings=None):
-    p = obs.obs_properties_get(props, 'discord_source')
-    obs.obs_property_list_clear(p)
-    obs.obs_property_list_add_string(p, '(none)', '')
     sources = obs.obs_enum_sources()
     labels = {}
     for src in sources:
         n = obs.obs_source_get_name(src)
         labels[n] = n + ' (' + obs.obs_source_get_display_name(obs.obs_source_get_id(src)) + ')'
     obs.source_list_release(sources)
-    for n in sorted(labels, key=lambda x: x.lower()):
-        obs.obs_property_list_add_string(p, labels[n], n)
+    names = sorted(labels, key=lambda x: x.lower())
+    for binding in bindings:
+        p = obs.obs_properties_get(props, binding.key('discord_source'))
+        obs.obs_property_list_clear(p)
+        obs.obs_property_list_add_string(p, '(none)', '')
+        for n in names:
+            obs.obs_property_list_add_string(p, labels[n], n)
     return True
 
 
+@timed('populate_participants')
 def populate_participants(props, p=None, _settings=None):
-    if not client.channel:
-        return False
-    values = []
-    for nick, name, disc, uid in ((x.nick, x.name, x.discriminator, x.id) for x in sorted(client.channel.guild.members, key=lambda x: x.display_name.lower() + '!') if x != client.user):
-        label = (nick or name) + ' ('
-        if nick:
-            label += name + ' '
-        label += f'#{disc})'
-        values.append((label, uid))
-    for name in ['myself'] + [f'participant{i}' for i in range(SLOTS)]:
-        p = obs.obs_properties_get(props, name)
-        obs.obs_property_list_clear(p)
-        obs.obs_property_list_add_string(p, '(none)', '')
-        for label, uid in values:
-            obs.obs_property_list_add_string(p, label, str(uid))
-    return True
+    _settings = _settings or settings
+    populated = False
+    for binding in bindings_of(p):
+        names = [binding.key(x) for x in ['myself'] + [f'participant{i}' for i in range(SLOTS)]]
+        uids = [obs.obs_data_get_string(_settings, x) for x in names]
+        try:
+            channel_id = int(obs.obs_data_get_string(_settings, binding.key('voice_channel')))
+        except ValueError:
+            channel_id = None
+        guild_id = channel_id and client.channel_guild(channel_id)
+        # Not the whole server, which might take OBS ages to list: whoever is picked or in the call, plus whoever matches the search.
+        values = client.member_picks(guild_id, channel_id, [int(x) for x in uids if x], obs.obs_data_get_string(_settings, binding.key('participant_search'))) if guild_id else None
+        if values is None and client.live:
+            continue
+        for name, selected in zip(names, uids):
+            p = obs.obs_properties_get(props, name)
+            obs.obs_property_list_clear(p)
+            obs.obs_property_list_add_string(p, '(none)', '')
+            if values is None: # Neither connected nor cached yet.
+                if selected:
+                    obs.obs_property_list_add_string(p, CONNECTING, selected)
+                continue
+            for label, uid in values:
+                obs.obs_property_list_add_string(p, label, uid)
+        populated = True
+    return populated
+
+
+def same_transform(a, b):
+    # Scale and bounds come back from OBS as 32-bit floats.
+    return a[0] == b[0] and a[3:] == b[3:] and all(math.isclose(x, y, rel_tol=1e-6) for x, y in zip(a[1] + a[2], b[1] + b[2]))
+
+
+@functools.lru_cache(maxsize=128)
+def layout(source_width, source_height, count, full_screen):
+    """Rectangle (x, y, width, height) of every caller in a Discord call grid, or None if the call window is too small to hold any."""
+    if not source_width or not source_height:
+        return None
+    margin_top = MARGIN_TOP
+    if not full_screen:
+        margin_top = margin_top + TITLE_BAR
+    totalw = source_width - MARGIN_SIDES * 2
+    totalh = source_height - margin_top - MARGIN_BTM
+    if totalw <= 0 or totalh <= 0:
+        return None
+
+    rows = None
+    cols = None
+    width = 0
+    height = None
+    wide = None
+    # Discord packs the callers in as many columns as possible, unless their videos appear bigger with fewer columns.
+    for c in reversed(range(1, count+1)):
+        r = math.ceil(count / c)
+        w = (totalw - CALLER_SPACING * (c - 1)) / c
+        h = (totalh - CALLER_SPACING * (r - 1)) / r
+        wi = w / h > CALLER_ASPECT
+        if wi:
+            w = h * CALLER_ASPECT
+        if w > width:
+            rows = r
+            cols = c
+            width = w
+            height = h
+            wide = wi
+    if not rows:
+        return None
+
+    # If the window is wider or taller than the callers fit in, Discord will center them as a whole.
+    offsetx = 0
+    offsety = 0
+    inner_width = (width * cols + CALLER_SPACING * (cols - 1))
+    if wide: # Wider than needed, therefore center horizontally.
+        offsetx = (totalw - inner_width) / 2
+    else: # Taller than needed, therefore center vertically.
+        height = width / CALLER_ASPECT # We compared using widths only before, so height needs to be adjusted.
+        offsety = (totalh - (height * rows + CALLER_SPACING * (rows - 1))) / 2
+
+    # If last row contains fewer callers than columns, Discord will center it.
+    offset_last = count % cols
+    if offset_last > 0:
+        offset_last = (inner_width - (width * offset_last + CALLER_SPACING * (offset_last - 1))) / 2
+
+    rects = []
+    for index in range(count):
+        # Get top left corner of this caller.
+        r = math.ceil((index + 1) / cols)
+        c = index % cols + 1
+        x = MARGIN_SIDES + offsetx + (width + CALLER_SPACING) * (c - 1)
+        if r == rows:
+            x = x + offset_last
+        y = margin_top + offsety + (height + CALLER_SPACING) * (r - 1)
+        rects.append((x, y, width, height))
+    return tuple(rects)
+
+
+@functools.lru_cache(maxsize=512)
+def caller_crop(source_width, source_height, rect, aspect):
+    """Crop (left, top, right, bottom) that shows the caller at rect without overflowing an item of the given aspect ratio."""
+    x, y, width, height = rect
+    clipx = 0
+    clipy = 0
+    if aspect > CALLER_ASPECT:
+        clipy = (height - width / aspect) / 2
+    else:
+        clipx = (width - height * aspect) / 2
+    return (
+        math.ceil(x + CALLER_BORDER + clipx),
+        math.ceil(y + CALLER_BORDER + clipy),
+        source_width - int(x + width - CALLER_BORDER - clipx),
+        source_height - int(y + height - CALLER_BORDER - clipy),
+    )
 
 
 def ordinal(n):
@@ -0,0 +1,681 @@
+"""Discord side of discrop: keeps track of who’s in the calls being mapped.
+
+It runs within OBS on a thread of its own, unless discrop is set to run it in a separate process, in which case
+OBS runs this module as a program and talks to it through stdin and stdout, while rosters go through a RosterBlock.
+"""
+import asyncio
+import bisect
+import collections
+import itertools
+import json
+import os.path
+import sys
+import threading
+import time
+import traceback
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lib', 'site-packages'))
+import discord
+
+from discrop_shared import Roster, RosterBlock, stats, timed
+
+CACHE_VERSION = 2
+FRAME = 1 / 60 # How often the worker publishes rosters, at most.
+PICKS = 100 # Most members listed in the participant menus besides those in the call and those already picked.
+LABELS_INTERVAL = 1 # s, how often member label changes are published at most.
+
+
+class Ordering:
+    """Participants sorted by name the way Discord does, kept sorted as they come and go instead of sorting them all over again."""
+
+    def __init__(self):
+        self.keys = {}
+        self.sorted = [] # (key, uid)
+
+    def __contains__(self, uid):
+        return uid in self.keys
+
+    def __iter__(self):
+        return (x[1] for x in self.sorted)
+
+    def add(self, uid, name):
+        # Discord sorts ‘ ’ before EOF, e.g. ‘foo bar’ > ‘foo’. Python doesn’t, but we can leverage the fact that ‘ ’ goes right before ‘!’.
+        key = name.lower() + '!'
+        old = self.keys.get(uid)
+        if key == old:
+            return False
+        if old is not None:
+            self.discard(uid)
+        self.keys[uid] = key
+        bisect.insort(self.sorted, (key, uid))
+        return True
+
+    def discard(self, uid):
+        key = self.keys.pop(uid, None)
+        if key is None:
+            return False
+        del self.sorted[bisect.bisect_left(self.sorted, (key, uid))]
+        return True
+
+
+class MemberLabels(Ordering):
+    """A guild’s members as labelled in the participant menus, in the same order as calls, kept up to date as members come, go and get
+    renamed rather than built again, so that looking some up never goes through the whole guild."""
+
+    def __init__(self, entries=()):
+        super().__init__()
+        self.entries = {} # uid -> (name, label)
+        for uid, name, label in entries:
+            self.entries[uid] = (name, label)
+            self.keys[uid] = key = name.lower() + '!'
+            self.sorted.append((key, uid))
+        self.sorted.sort() # Once, rather than inserting them one by one.
+
+    def __len__(self):
+        return len(self.keys)
+
+    def set(self, member):
+        self.set_entry(*member_entry(member.id, member.nick, member.name, member.discriminator))
+
+    def set_entry(self, uid, name, label):
+        self.add(uid, name) # First, as it discards the old entry when the name changed.
+        self.entries[uid] = (name, label)
+
+    def discard(self, uid):
+        self.entries.pop(uid, None)
+        return super().discard(uid)
+
+    def label(self, uid):
+        return self.entries[uid][1]
+
+    def starting_with(self, prefix, count):
+        """Up to count uids, in order, of those whose name starts with prefix (whatever the case)."""
+        key = prefix.lower()
+        uids = []
+        for k, uid in self.sorted[bisect.bisect_left(self.sorted, (key,)):]:
+            if len(uids) == count or not k.startswith(key):
+                break
+            uids.append(uid)
+        return uids
+
+    def dump(self, uids):
+        """Entries of those of uids who are members, for MemberLabels() to take."""
+        return [[x, *self.entries[x]] for x in uids if x in self.entries]
+
+    def copy(self):
+        labels = MemberLabels()
+        labels.keys = dict(self.keys)
+        labels.sorted = list(self.sorted)
+        labels.entries = dict(self.entries)
+        return labels
+
+
+class Call:
+    """Who’s in one of the voice channels being mapped, with and without video, kept in Discord’s order."""
+
+    def __init__(self):
+        self.audio = Ordering()
+        self.video = Ordering()
+        self.roster = Roster()
+
+    def join(self, uid, name, video):
+        # Also for when someone turns their camera on or off.
+        if video:
+            return self.audio.discard(uid) | self.video.add(uid, name)
+        return self.video.discard(uid) | self.audio.add(uid, name)
+
+    def leave(self, uid):
+        return self.audio.discard(uid) | self.video.discard(uid)
+
+    def update(self, members):
+        """Bring it in line with (uid, name, video) of everyone in the call, and return whether that changed anything."""
+        uids = {x[0] for x in members}
+        changed = False
+        for uid in [x for x in itertools.chain(self.video, self.audio) if x not in uids]:
+            changed = self.leave(uid) or changed
+        for uid, name, video in members:
+            changed = self.join(uid, name, video) or changed
+        return changed
+
+    def members(self):
+        """(uid, name, video) of everyone in the call, as update() takes them. Names come out lowercase, which is all the ordering needs."""
+        return [(y, x[:-1], True) for x, y in self.video.sorted] + [(y, x[:-1], False) for x, y in self.audio.sorted]
+
+    def rename(self, uid, name):
+        if uid in self.audio:
+            return self.audio.add(uid, name)
+        if uid in self.video:
+            return self.video.add(uid, name)
+        return False
+
+    def publish(self, generation, since=None):
+        self.roster = Roster(self.video, self.audio, generation, since)
+
+
+def member_entry(uid, nick, name, discriminator):
+    """(uid, name, label) of a member, as MemberLabels takes them."""
+    label = (nick or name) + ' ('
+    if nick:
+        label += name + ' '
+    return uid, nick or name, label + f'#{discriminator})'
+
+
+# How Discord objects are written into traces, compactly.
+def trace_member(member):
+    return [member.id, member.name, member.discriminator, member.nick]
+
+def trace_voice(state):
+    return [state.channel and state.channel.id, state.self_video]
+
+def trace_channel(channel):
+    return [channel.id, channel.name, channel.position]
+
+def trace_guild(guild):
+    return [guild.id, guild.name, [trace_channel(x) for x in guild.channels if isinstance(x, discord.VoiceChannel)]]
+
+
+class Client(discord.Client):
+
+    def __init__(self, lean=False):
+        if asyncio.get_event_loop().is_closed(): # From the previous time the script was loaded.
+            asyncio.set_event_loop(asyncio.new_event_loop())
+        intents = discord.Intents(guilds=True, members=True, voice_states=True)
+        if lean:
+            # Don’t wait for every guild’s members at startup nor keep them around: only those in voice, plus the selected channels’ guilds once they’re chunked.
+            flags = discord.MemberCacheFlags.none()
+            flags.voice = True
+            super().__init__(intents=intents, chunk_guilds_at_startup=False, member_cache_flags=flags)
+        else:
+            super().__init__(intents=intents)
+        self.lean = lean
+        self.rosters = {} # Channel ID -> roster. Replaced as a whole on every change, never modified.
+        # Event handlers only queue what changed, and the OBS thread applies it all at once every frame with drain(), so that a burst of events costs a single re-layout.
+        self.events = collections.deque() # (time, kind, ...) Appending and popping are thread-safe.
+        self._calls = {} # Channel ID -> call. Only touched by drain().
+        self._generation = 0 # Of the latest roster published, whichever the call, so that a call watched again never repeats an old one’s.
+        self._channel_ids = frozenset() # Requested channels, which might have to wait for the client to be ready.
+        self._picked = frozenset() # Participants picked in the menus, whose labels are worth caching.
+        self._watched = {} # Channel ID -> channel, for those requested that actually exist.
+        self._channel_labels = None
+        # Member labels of every guild once the client is ready, from the chunk in lean mode. They’re only changed on the client’s event loop,
+        # and published for the OBS thread to read the same way rosters are: as a whole, and never modified afterwards.
+        self.member_labels = {} # Guild ID -> MemberLabels. Replaced as a whole on every change, never modified.
+        self._member_labels = {} # Guild ID -> MemberLabels, the same ones until they change, as they’re copied first.
+        self._stale_labels = set() # Guild IDs whose labels changed since they were last published.
+        self._chunking = set() # Guild IDs chunked or being chunked in lean mode, so that it only happens once.
+        self._channel_guilds = {} # Channel ID -> guild ID, from the cache until the client is ready.
+        self.live = False # Whether the client has been ready at some point, so that the cache is no longer needed.
+        self.trace = None # File Discord events are being recorded into, if any.
+        self._trace_start = 0
+        self._trace_lock = threading.Lock() # Both threads write into it.
+        self.thread = None
+
+    def start(self, token):
+        self.thread = threading.Thread(target=self.run, args=(token,))
+        self.thread.start()
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(lambda: asyncio.ensure_future(self.close()))
+        self.thread.join()
+        self.record(None)
+
+    def poll(self):
+        """Bring the rosters up to date. Only to be called from a single thread, every frame: OBS’s, or the worker’s event loop."""
+        if self.events:
+            self.drain()
+
+    @property
+    def invite_url(self):
+        return discord.utils.oauth_url(self.user.id, discord.Permissions(connect=True))
+
+    def record(self, path):
+        """Start appending Discord events into a trace file at path (JSON lines), or stop if it’s None. bench/replay.py plays them back."""
+        with self._trace_lock:
+            if self.trace:
+                self.trace.close()
+                self.trace = None
+            if path:
+                self.trace = open(path, 'a', encoding='utf-8', buffering=1) # Line-buffered, so that it’s usable even if OBS crashes.
+                self._trace_start = time.perf_counter()
+        if path:
+            self.trace_event('start', time=time.time())
+            if self.is_ready(): # Everything the events that follow build on.
+                self.trace_event('ready', guilds=[trace_guild(x) for x in self.guilds])
+                self.trace_event('watch', channels=sorted(self._watched))
+                for channel in self._watched.values():
+                    self.trace_event('call', channel=channel.id, members=[trace_member(x) + [x.voice.self_video] for x in channel.members])
+
+    def trace_event(self, kind, **fields):
+        fields['t'] = round(time.perf_counter() - self._trace_start, 6)
+        fields['e'] = kind
+        line = json.dumps(fields, ensure_ascii=False, separators=(',', ':')) + '\n'
+        with self._trace_lock:
+            if self.trace:
+                self.trace.write(line)
+
+    def warm_start(self, cache):
+        """Pick up where the last session left off, until the client is ready: channel and member lists, and who was in the calls."""
+        if cache.get('version') != CACHE_VERSION:
+            return
+        self._channel_labels = [tuple(x) for x in cache['channels']] or None
+        self._member_labels = {int(x): MemberLabels(y) for x, y in cache['members'].items()}
+        self.member_labels = dict(self._member_labels)
+        self._channel_guilds = {int(x): y for x, y in cache['guilds'].items()}
+        for channel_id, members in cache['calls'].items():
+            self.events.append((time.perf_counter(), 'call', int(channel_id), [tuple(x) for x in members]))
+
+    def cache(self):
+        """What warm_start() needs, for the channels being watched: only the labels of those picked or in the calls, rather than
+        whole guilds, so that it stays small. Only to be called from the thread that polls, once the client is stopped unless that’s its
+        event loop."""
+        guilds = {x: y.guild.id for x, y in self._watched.items()} if self.live else self._channel_guilds
+        calls = {x: y.members() for x, y in self._calls.items() if x in guilds}
+        uids = set(self._picked)
+        for members in calls.values():
+            uids.update(x[0] for x in members)
+        members = {}
+        for guild_id in set(guilds.values()):
+            labels = self._member_labels.get(guild_id)
+            if labels:
+                members[guild_id] = labels.dump(uids)
+        return {
+            'version': CACHE_VERSION,
+            'channels': self.channel_labels or [],
+            'guilds': guilds,
+            'members': members,
+            'calls': calls,
+        }
+
+    def pick(self, uids):
+        self._picked = frozenset(uids)
+
+    def watch(self, channels):
+        channels = frozenset(channels)
+        if channels == self._channel_ids and channels == self._watched.keys():
+            return # Nothing new, as with most setting changes.
+        self._channel_ids = channels
+        if self.is_ready():
+            self._watch_channels()
+
+    def _watch_channels(self):
+        watched = {}
+        for channel_id in self._channel_ids:
+            channel = self.get_channel(channel_id)
+            if channel:
+                watched[channel_id] = channel
+        new = [y for x, y in watched.items() if x not in self._watched]
+        self._watched = watched
+        if self.trace:
+            self.trace_event('watch', channels=sorted(watched))
+        self.events.append((time.perf_counter(), 'watch', frozenset(watched)))
+        for channel in new:
+            self._snapshot(channel)
+        for channel in watched.values():
+            if self.lean and channel.guild.id not in self._chunking:
+                # Not guild.chunked, which the voice-only cache policy turns back off as soon as chunked members leave voice.
+                self._chunking.add(channel.guild.id)
+                asyncio.run_coroutine_threadsafe(self._chunk(channel.guild), self.loop)
+
+    def _snapshot(self, channel):
+        # Who’s in the call right now, to start it over from.
+        members = channel.members
+        if self.trace:
+            self.trace_event('call', channel=channel.id, members=[trace_member(x) + [x.voice.self_video] for x in members])
+        self.events.append((time.perf_counter(), 'call', channel.id, [(x.id, x.display_name, x.voice.self_video) for x in members]))
+
+    async def _chunk(self, guild):
+        # The member cache would drop them again as they leave voice, so they’re only kept as labels, which events keep up to date.
+        try:
+            members = await guild.chunk(cache=False)
+        except Exception:
+            self._chunking.discard(guild.id) # So that it’s tried again when a channel of it is picked.
+            raise
+        self._member_labels[guild.id] = self.guild_labels(members)
+        self._publish_labels(guild.id) # Right away, as someone is likely waiting for them in the properties view.
+        # Some members in voice might have been missing until now.
+        for channel in self._watched.values():
+            if channel.guild == guild:
+                self._snapshot(channel)
+
+    def watches(self, guild):
+        return any(x.guild == guild for x in self._watched.values())
+
+    def dispatch(self, event, *args, **kwargs):
+        if self.lean:
+            if event == 'socket_response':
+                self._member_payload(args[0])
+            # Member updates from any other guild than the selected channels’ are of no use, so don’t even schedule them.
+            elif event == 'member_update' and not self.watches(args[1].guild):
+                return
+        super().dispatch(event, *args, **kwargs)
+
+    def _member_payload(self, message):
+        # In lean mode, discord.py ignores updates and removals of members it doesn’t cache (those not in voice), so labels are kept up to
+        # date from the gateway’s messages themselves. Members joining are dispatched either way.
+        kind = message.get('t')
+        if kind not in ('GUILD_MEMBER_UPDATE', 'GUILD_MEMBER_REMOVE'):
+            return
+        data = message['d']
+        labels = self._change_labels(int(data['guild_id']))
+        if labels is None:
+            return
+        user = data['user']
+        if kind == 'GUILD_MEMBER_REMOVE':
+            labels.discard(int(user['id']))
+        else:
+            labels.set_entry(*member_entry(int(user['id']), data.get('nick'), user['username'], user['discriminator']))
+
+    @timed('Client.drain')
+    def drain(self):
+        """Apply every queued event, then publish each call they changed just once. Only to be called from the thread that polls."""
+        changed = {} # Call -> time of its earliest change.
+        count = 0
+        while self.events:
+            event = self.events.popleft()
+            since, kind = event[:2]
+            count += 1
+            if kind == 'voice':
+                _, _, uid, name, old, new, video = event
+                old = self._calls.get(old)
+                new = self._calls.get(new)
+                if old and old is not new:
+                    old.leave(uid)
+                    changed.setdefault(old, since)
+                if new:
+                    new.join(uid, name, video)
+                    changed.setdefault(new, since)
+            elif kind == 'rename':
+                _, _, channel_id, uid, name = event
+                call = self._calls.get(channel_id)
+                if call and call.rename(uid, name):
+                    changed.setdefault(call, since)
+            elif kind == 'call':
+                _, _, channel_id, members = event
+                # Those from the cache are only good until the client is ready.
+                if channel_id in self._watched or channel_id in self._channel_ids and not self.live:
+                    call = self._calls.get(channel_id)
+                    if not call:
+                        call = self._calls[channel_id] = Call()
+                        changed.setdefault(call, since)
+                    if call.update(members): # Picking up from the cache usually doesn’t change a thing.
+                        changed.setdefault(call, since)
+            elif kind == 'watch':
+                self._calls = {x: y for x, y in self._calls.items() if x in event[2]}
+        for call, since in changed.items():
+            self._generation += 1
+            call.publish(self._generation, since)
+        self.rosters = {x: y.roster for x, y in self._calls.items()}
+        if stats.enabled:
+            stats.record('Discord events per drain', count, 'events')
+
+    @property
+    def channel_labels(self):
+        """(label, channel ID) of every voice channel the bot can see, kept until a guild or channel event invalidates it. Until the client is ready, those from the cache if any, None otherwise."""
+        labels = self._channel_labels
+        if labels is None and self.live:
+            labels = []
+            for guild in sorted(self.guilds, key=lambda x: x.name.lower()):
+                for channel in sorted(guild.channels, key=lambda x: x.position):
+                    if isinstance(channel, discord.VoiceChannel):
+                        labels.append((guild.name + ' -> ' + channel.name, str(channel.id)))
+            self._channel_labels = labels
+        return labels
+
+    def guild_labels(self, members):
+        """MemberLabels of members, but the bot."""
+        return MemberLabels(member_entry(x.id, x.nick, x.name, x.discriminator) for x in members if x != self.user)
+
+    def _change_labels(self, guild_id):
+        """The guild’s labels, to change right away, or None if it has none. They’re copied first if they’re the ones published, and
+        published again along with any other change within LABELS_INTERVAL, as copying a big guild’s isn’t free."""
+        labels = self._member_labels.get(guild_id)
+        if labels is None:
+            return None
+        if labels is self.member_labels.get(guild_id):
+            labels = self._member_labels[guild_id] = labels.copy()
+        if not self._stale_labels:
+            self.loop.call_later(LABELS_INTERVAL, self._publish_labels)
+        self._stale_labels.add(guild_id)
+        return labels
+
+    def _publish_labels(self, *guild_ids):
+        self._stale_labels.update(guild_ids)
+        published = dict(self.member_labels)
+        for guild_id in self._stale_labels:
+            labels = self._member_labels.get(guild_id)
+            if labels is None:
+                published.pop(guild_id, None)
+            else:
+                published[guild_id] = labels
+        self._stale_labels.clear()
+        self.member_labels = published
+
+    def member_picks(self, guild_id, channel_id, uids, search=''):
+        """(label, user ID) of the members to list in the participant menus: those given and those in the call first, then up to PICKS
+        of those whose name starts with search, or everyone if there aren’t more than that. None if the guild isn’t known (yet).
+        In lean mode, until the guild is chunked, only those who were in voice when the client got ready are known."""
+        labels = self.member_labels.get(guild_id)
+        if labels is None:
+            return None
+        roster = self.rosters.get(channel_id)
+        first = {x for x in itertools.chain(uids, roster.index if roster else ()) if x in labels}
+        picks = sorted(first, key=lambda x: (labels.keys[x], x))
+        if search or len(labels) <= PICKS:
+            picks += [x for x in labels.starting_with(search, PICKS + len(first)) if x not in first][:PICKS]
+        return [(labels.label(x), str(x)) for x in picks]
+
+    def channel_guild(self, channel_id):
+        """ID of the guild a channel belongs to, from the cache if the client isn’t ready yet."""
+        if not self.live:
+            return self._channel_guilds.get(channel_id)
+        channel = self.get_channel(channel_id)
+        return channel and channel.guild.id
+
+    # Anything that could change the channel list.
+    async def on_guild_join(self, guild):
+        self._channel_labels = None
+        self._member_labels[guild.id] = self.guild_labels(guild.members)
+        self._publish_labels(guild.id)
+        if self.trace:
+            self.trace_event('guild_join', guild=trace_guild(guild))
+
+    async def on_guild_remove(self, guild):
+        self._channel_labels = None
+        self._member_labels.pop(guild.id, None)
+        self._publish_labels(guild.id)
+        self._chunking.discard(guild.id)
+        if self.trace:
+            self.trace_event('guild_remove', guild=guild.id)
+
+    async def on_guild_update(self, before, after):
+        self._channel_labels = None
+
+    async def on_guild_channel_create(self, channel):
+        self._channel_labels = None
+        if self.trace and isinstance(channel, discord.VoiceChannel):
+            self.trace_event('guild_channel_create', guild=channel.guild.id, channel=trace_channel(channel))
+
+    async def on_guild_channel_delete(self, channel):
+        self._channel_labels = None
+        if self.trace and isinstance(channel, discord.VoiceChannel):
+            self.trace_event('guild_channel_delete', guild=channel.guild.id, channel=channel.id)
+
+    async def on_guild_channel_update(self, before, after):
+        self._channel_labels = None
+        if self.trace and isinstance(after, discord.VoiceChannel):
+            self.trace_event('guild_channel_update', guild=after.guild.id, channel=trace_channel(after))
+
+    # Anything that could change a member list.
+    async def on_member_join(self, member):
+        labels = self._change_labels(member.guild.id)
+        if labels is not None:
+            labels.set(member)
+        if self.trace:
+            self.trace_event('member_join', guild=member.guild.id, member=trace_member(member))
+
+    async def on_member_remove(self, member):
+        labels = self._change_labels(member.guild.id)
+        if labels is not None:
+            labels.discard(member.id)
+        if self.trace:
+            self.trace_event('member_remove', guild=member.guild.id, member=member.id)
+
+    async def on_user_update(self, before, after):
+        # Usernames show up in every guild.
+        for guild_id, labels in list(self._member_labels.items()):
+            guild = after.id in labels and self.get_guild(guild_id)
+            member = guild and guild.get_member(after.id)
+            if member:
+                self._change_labels(guild_id).set(member)
+
+    async def on_ready(self):
+        # Whatever came from the cache is brought in line with the real thing right away, on this thread rather than on OBS’s the next
+        # time the properties are shown, while the calls are brought in line with it too.
+        self.live = True
+        self._channel_labels = None
+        self.channel_labels # Rebuilt now.
+        self._chunking.clear()
+        cached = self._member_labels
+        self._member_labels = {}
+        for guild in self.guilds:
+            labels = cached.get(guild.id)
+            if self.lean and labels is not None:
+                # Whoever the member cache holds, on top of what was known, until the guild’s chunk replaces them all.
+                labels = labels.copy() # As they might be published.
+                for member in guild.members:
+                    if member != self.user:
+                        labels.set(member)
+            else:
+                labels = self.guild_labels(guild.members) # Sorted once, rather than each member inserted into the few that were cached.
+            self._member_labels[guild.id] = labels
+        self._stale_labels.clear()
+        self.member_labels = dict(self._member_labels)
+        if self.trace:
+            self.trace_event('ready', guilds=[trace_guild(x) for x in self.guilds])
+        self._watch_channels()
+
+    @timed('Client.on_member_update')
+    async def on_member_update(self, before, after):
+        if self.trace:
+            self.trace_event('member_update', guild=after.guild.id, before=trace_member(before), after=trace_member(after), voice=after.voice and trace_voice(after.voice))
+        if (before.nick, before.name, before.discriminator) != (after.nick, after.name, after.discriminator):
+            labels = self._change_labels(after.guild.id)
+            if labels is not None:
+                labels.set(after)
+        # before.id == after.id (duh), so it doesn’t matter which one we use.
+        channel = after.voice and after.voice.channel
+        if channel and channel.id in self._watched and before.display_name != after.display_name:
+            self.events.append((time.perf_counter(), 'rename', channel.id, after.id, after.display_name))
+
+    @timed('Client.on_voice_state_update')
+    async def on_voice_state_update(self, member, before, after):
+        if self.trace:
+            self.trace_event('voice_state_update', guild=member.guild.id, member=trace_member(member), before=trace_voice(before), after=trace_voice(after))
+        old = before.channel and before.channel.id
+        new = after.channel and after.channel.id
+        if old not in self._watched and new not in self._watched:
+            return
+        if old == new and before.self_video == after.self_video:
+            return
+        self.events.append((time.perf_counter(), 'voice', member.id, member.display_name, old, new, after.self_video))
+
+
+class Worker:
+    """Runs the client as a process of its own: commands come in through stdin and replies go out through stdout, both as JSON lines, while rosters go through a RosterBlock.
+
+    OBS waits for the replies to its queries, if only briefly, so every query gets one, even if handling it failed. The channel list and
+    the invite URL change rarely, so they’re sent over whenever they do instead, for OBS to have them at hand.
+    """
+
+    QUERIES = ('member_picks',)
+
+    def __init__(self, stdin, stdout):
+        self.stdin = stdin
+        self.stdout = stdout
+        start = json.loads(stdin.readline()) # The token comes this way rather than as an argument, so that it doesn’t show up in the list of processes.
+        self.token = start['token']
+        self.client = Client(start['lean'])
+        self.block = RosterBlock(start['block'])
+        self.rosters = None
+        self.ready = False
+        self.channel_labels = None
+
+    def send(self, **message):
+        try:
+            self.stdout.write(json.dumps(message) + '\n')
+            self.stdout.flush()
+        except OSError: # OBS is gone, which listen() will notice.
+            pass
+
+    def listen(self):
+        # On a thread of its own, since reading blocks. Everything else happens on the client’s event loop.
+        for line in self.stdin:
+            self.client.loop.call_soon_threadsafe(self.handle, json.loads(line))
+        self.client.loop.call_soon_threadsafe(self.handle, {'command': 'stop'}) # OBS is gone.
+
+    def handle(self, message):
+        try:
+            result = self.execute(message)
+        except Exception:
+            traceback.print_exc() # Into OBS’s script log, through stderr.
+            result = None
+        if 'id' in message:
+            self.send(id=message['id'], result=result)
+
+    def execute(self, message):
+        client = self.client
+        command = message['command']
+        result = None
+        if command == 'watch':
+            client.watch(message['channels'])
+        elif command == 'pick':
+            client.pick(message['uids'])
+        elif command == 'warm_start':
+            client.warm_start(message['cache'])
+        elif command == 'record':
+            client.record(message['path'])
+        elif command == 'trace_event':
+            client.trace_event(message['kind'], **message['fields'])
+        elif command in self.QUERIES:
+            result = getattr(client, command)
+            if message.get('args') is not None:
+                result = result(*message['args'])
+            elif callable(result):
+                result = result()
+        elif command == 'stop' and not client.is_closed():
+            client.poll()
+            result = client.cache()
+            client.record(None)
+            asyncio.ensure_future(client.close())
+        return result
+
+    async def publish(self):
+        while not self.client.is_closed():
+            self.client.poll()
+            if self.client.rosters is not self.rosters:
+                self.rosters = self.client.rosters
+                self.block.write(self.rosters)
+            if self.client.is_ready() != self.ready:
+                self.ready = not self.ready
+                self.send(ready=self.ready, invite_url=self.client.invite_url if self.ready else None)
+            labels = self.client.channel_labels
+            if labels is not self.channel_labels:
+                self.channel_labels = labels
+                self.send(channels=labels, guilds=[(x, self.client.channel_guild(int(x))) for _, x in labels or ()])
+            await asyncio.sleep(FRAME)
+
+    def run(self):
+        threading.Thread(target=self.listen, daemon=True).start()
+        self.client.loop.create_task(self.publish())
+        try:
+            self.client.run(self.token)
+        finally:
+            self.block.close()
+
+
+if __name__ == '__main__':
+    # Only replies go through stdout: anything else printed, by us or by libraries, goes to stderr and ends up in OBS’s script log.
+    protocol = os.fdopen(os.dup(sys.stdout.fileno()), 'w', encoding='utf-8')
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    sys.stdout = sys.stderr
+    Worker(sys.stdin, protocol).run()
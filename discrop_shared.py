@@ -0,0 +1,162 @@
+"""What both sides of discrop use, whether the Discord client runs within OBS or in a process of its own: instrumentation, roster snapshots, and the shared memory block the latter go through between processes."""
+import asyncio
+import collections
+import functools
+import mmap
+import struct
+import time
+
+CALLS = 4 # Calls a single instance of the script can map at once, all through the same bot.
+
+
+class Stats:
+    """Timings and counters of the hot paths, to tell whether a stuttering stream has anything to do with this script."""
+
+    SAMPLES = 1000 # Most recent ones kept for each measurement.
+    LOG_INTERVAL = 60000 # ms
+
+    def __init__(self):
+        self.enabled = False
+        self.reset()
+
+    def reset(self):
+        self.samples = {}
+        self.counts = {}
+        self.units = {}
+        self.setters = 0 # OBS setter calls, counted by the scene items themselves.
+
+    def record(self, name, value, unit='ms'):
+        samples = self.samples.get(name)
+        if samples is None:
+            samples = self.samples[name] = collections.deque(maxlen=self.SAMPLES)
+            self.units[name] = unit
+        samples.append(value * 1000 if unit == 'ms' else value)
+        self.counts[name] = self.counts.get(name, 0) + 1
+
+    def summary(self):
+        if not self.enabled:
+            return 'Instrumentation is off.'
+        lines = []
+        for name in sorted(self.samples):
+            samples = sorted(self.samples[name])
+            unit = self.units[name]
+            p50 = samples[len(samples) // 2]
+            p99 = samples[min(len(samples) - 1, len(samples) * 99 // 100)]
+            lines.append(f'{name}: {self.counts[name]}×, p50 {p50:.3g} {unit}, p99 {p99:.3g} {unit}, max {samples[-1]:.3g} {unit}')
+        return '\n'.join(lines) or 'Nothing measured yet.'
+
+
+stats = Stats()
+
+
+def timed(name):
+    """Record how long every call of the decorated function or coroutine takes, as long as instrumentation is on."""
+    def decorator(f):
+        if asyncio.iscoroutinefunction(f):
+            @functools.wraps(f)
+            async def wrapper(*args, **kwargs):
+                if not stats.enabled:
+                    return await f(*args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    return await f(*args, **kwargs)
+                finally:
+                    stats.record(name, time.perf_counter() - start)
+        else:
+            @functools.wraps(f)
+            def wrapper(*args, **kwargs):
+                if not stats.enabled:
+                    return f(*args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    return f(*args, **kwargs)
+                finally:
+                    stats.record(name, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+class Roster:
+    """Immutable snapshot of who’s in the call, in Discord’s order, which can be read from any thread without locking."""
+
+    def __init__(self, video=(), audio=(), generation=0, since=None):
+        self.video = tuple(video)
+        self.audio = tuple(audio)
+        self.generation = generation
+        self.time = since or time.perf_counter() # When the earliest change in it happened, to measure how long it takes to show up in the scenes.
+        self.index = {x: i for i, x in enumerate(self.video + self.audio)} # Audio-only participants go after everyone with video.
+        self.video_uids = frozenset(self.video)
+        self.audio_uids = frozenset(self.audio)
+
+
+class RosterBlock:
+    """Fixed-size block of memory, mapped by both processes, which the Discord process publishes rosters into and OBS reads them from every frame.
+
+    It’s guarded by a sequence counter rather than a lock: the writer makes it odd while writing and even again afterwards, and a reader tries
+    again if it was odd or changed meanwhile. Rosters only hold user IDs in order, video first, so that the block doesn’t need to grow with names.
+    """
+
+    MEMBERS = 99 # Discord’s maximum user limit for voice channels.
+    HEADER = struct.Struct('<QI4x') # Sequence counter, calls.
+    CALL = struct.Struct('<QQdHH4x') # Channel ID, generation, time of earliest change, with video, without.
+    UIDS = struct.Struct(f'<{MEMBERS}Q')
+    SIZE = HEADER.size + CALLS * (CALL.size + UIDS.size)
+    RETRIES = 100
+
+    def __init__(self, path):
+        self.file = open(path, 'r+b')
+        self.map = mmap.mmap(self.file.fileno(), self.SIZE)
+        self.seq = 0
+
+    @classmethod
+    def create(cls, path):
+        with open(path, 'wb') as f:
+            f.write(bytes(cls.SIZE))
+        return cls(path)
+
+    def write(self, rosters):
+        """Publish {channel ID: roster}. Only one process may write."""
+        if len(rosters) > CALLS:
+            raise ValueError(f'{len(rosters)} calls, while the block only holds {CALLS}')
+        rosters = list(rosters.items())
+        self.seq += 1
+        self.HEADER.pack_into(self.map, 0, self.seq, len(rosters)) # Odd: being written.
+        offset = self.HEADER.size
+        for channel_id, roster in rosters:
+            video = roster.video[:self.MEMBERS]
+            audio = roster.audio[:self.MEMBERS - len(video)]
+            self.CALL.pack_into(self.map, offset, channel_id, roster.generation, roster.time, len(video), len(audio))
+            uids = video + audio
+            self.UIDS.pack_into(self.map, offset + self.CALL.size, *(uids + (0,) * (self.MEMBERS - len(uids))))
+            offset += self.CALL.size + self.UIDS.size
+        self.seq += 1
+        self.HEADER.pack_into(self.map, 0, self.seq, len(rosters))
+
+    def sequence(self):
+        return self.HEADER.unpack_from(self.map, 0)[0]
+
+    def read(self, previous=None):
+        """(sequence, {channel ID: roster}), reusing the rosters in previous whose generation didn’t change, or None if it kept changing meanwhile.
+        Generations never repeat across the calls of a client, so one that was unwatched and watched again can’t pass for its old roster."""
+        previous = previous or {}
+        for _ in range(self.RETRIES):
+            seq, count = self.HEADER.unpack_from(self.map, 0)
+            if seq & 1:
+                continue
+            rosters = {}
+            offset = self.HEADER.size
+            for _ in range(min(count, CALLS)):
+                channel_id, generation, since, video, audio = self.CALL.unpack_from(self.map, offset)
+                roster = previous.get(channel_id)
+                if not roster or roster.generation != generation:
+                    uids = self.UIDS.unpack_from(self.map, offset + self.CALL.size)
+                    roster = Roster(uids[:video], uids[video:video + audio], generation, since)
+                rosters[channel_id] = roster
+                offset += self.CALL.size + self.UIDS.size
+            if self.sequence() == seq:
+                return seq, rosters
+        return None
+
+    def close(self):
+        self.map.close()
+        self.file.close()